@@ -1,5 +1,5 @@
 """Restaurant recommendation agent module."""
 
-from agent.agent import RestaurantAgent, get_system_prompt, search_restaurants, get_walking_time
+from agent.agent import RestaurantAgent, RestaurantTools, get_search, get_system_prompt
 
-__all__ = ['RestaurantAgent', 'get_system_prompt', 'search_restaurants', 'get_walking_time']
+__all__ = ['RestaurantAgent', 'RestaurantTools', 'get_search', 'get_system_prompt']
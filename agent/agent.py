@@ -1,281 +1,292 @@
 """Restaurant recommendation chat agent with search and location tools."""
 
+import functools
 import os
 from datetime import datetime
+from math import cos, radians, sqrt
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
-import numpy as np
 from dotenv import load_dotenv
 from lisette.core import Chat, Message
 
-from search import RestaurantSearch
+from search import RestaurantSearch, parse_minutes
 
 
 load_dotenv()
 
+_MADRID_TZ = ZoneInfo("Europe/Madrid")
+
+# Prompt template is static, so read it once at import instead of per call
+_PROMPT_TEMPLATE = (Path(__file__).parent / "system_prompt.txt").read_text(encoding="utf-8")
+
+# Meal context for each hour of the day (breakfast 7-11, lunch 13-16, dinner 19-22)
+_MEAL_CONTEXT = tuple(
+    "- Es hora de desayuno." if 7 <= hour < 11 else
+    "- Es hora de almuerzo." if 13 <= hour < 16 else
+    "- Es hora de cena." if 19 <= hour < 22 else
+    ""
+    for hour in range(24)
+)
+
+# Default ChromaDB location used by the agent and its tools
+DB_PATH = os.getenv("CHROMA_PATH", "chromadb")
+
+
+@functools.cache
+def get_search(db_path: str = DB_PATH) -> RestaurantSearch:
+    """Create and index the search backend once per database path."""
+    search = RestaurantSearch(db_path=db_path)
+    search.load_and_index()
+    return search
 
 
 def get_system_prompt():
     """Generate system prompt with current context."""
-    now = datetime.now(ZoneInfo("Europe/Madrid"))
+    now = datetime.now(_MADRID_TZ)
     current_time = now.strftime("%H:%M")
     current_date = now.strftime("%A, %d de %B de %Y")
     
-    # Determine if it's meal time
-    hour = now.hour
-    if 7 <= hour < 11:
-        meal_context = "- Es hora de desayuno."
-    elif 13 <= hour < 16:
-        meal_context = "- Es hora de almuerzo."
-    elif 19 <= hour < 22:
-        meal_context = "- Es hora de cena."
-    else:
-        meal_context = ""
-    
-    # Load prompt template from file
-    prompt_file = Path(__file__).parent / "system_prompt.txt"
-    template = prompt_file.read_text(encoding="utf-8")
-    
-    # Format with current context
-    return template.format(
+    # Format cached template with current context
+    return _PROMPT_TEMPLATE.format(
         current_date=current_date,
         current_time=current_time,
-        meal_context=meal_context
+        meal_context=_MEAL_CONTEXT[now.hour]
     )
 
 
-def search_restaurants(
-    query: str,  # Natural language search query (e.g., "Italian food", "gluten free", "cheap lunch", "north zone")
-    n_results: int = 3,  # Number of results to return
-    price_level: str = None,  # Filter by price: "low", "medium", or "high"
-    zone: str = None,  # Filter by mall zone: "north", "center", or "south"
-    has_vegetarian: bool = None,  # Filter for vegetarian options
-    has_vegan: bool = None,  # Filter for vegan options
-    has_gluten_free: bool = None,  # Filter for gluten-free options
-    has_takeaway: bool = None,  # Filter for takeaway service
-    has_bar: bool = None,  # Filter for restaurants with bar service
-    has_menu: bool = None,  # Filter for restaurants with available menu
-    allow_reservations: bool = None,  # Filter for restaurants that accept reservations
-    open_now: bool = None,  # Filter for restaurants currently open
-    open_at_time: str = None  # Filter for restaurants open at specific time (format: "HH:MM", e.g., "14:30")
-) -> str:
-    """Search for restaurants in the mall based on user preferences.
+class RestaurantTools:
+    """Agent tools bound to one search backend."""
     
-    Returns formatted restaurant information including descriptions, cuisine types, dietary options, 
-    menu highlights, location zone, services, hours, and contact details."""
-    
-    # Initialize search
-    search = RestaurantSearch._instance
-    if search is None:
-        search = RestaurantSearch(db_path="chromadb")
-        search.load_and_index()
+    def __init__(self, search: RestaurantSearch):
+        """Initialize the tools.
+        
+        Args:
+            search: Indexed search backend the tools query
+        """
+        self.search = search
     
-    # Build filter kwargs
-    filter_kwargs = {}
-    if price_level:
-        filter_kwargs['price_level'] = price_level
-    if zone:
-        filter_kwargs['zone'] = zone
-    if has_vegetarian is not None:
-        filter_kwargs['has_vegetarian'] = has_vegetarian
-    if has_vegan is not None:
-        filter_kwargs['has_vegan'] = has_vegan
-    if has_gluten_free is not None:
-        filter_kwargs['has_gluten_free'] = has_gluten_free
-    if has_takeaway is not None:
-        filter_kwargs['has_takeaway'] = has_takeaway
-    if has_bar is not None:
-        filter_kwargs['has_bar'] = has_bar
-    if has_menu is not None:
-        filter_kwargs['has_menu'] = has_menu
-    if allow_reservations is not None:
-        filter_kwargs['allow_reservations'] = allow_reservations
+    @functools.cached_property
+    def coords(self) -> dict[str, tuple[float, float]]:
+        """Map restaurant names to (latitude, longitude), read once from the index."""
+        metadatas = self.search.vector_store.collection.get(include=['metadatas'])['metadatas']
+        return {meta['name']: (meta['latitude'], meta['longitude']) for meta in metadatas}
     
-    # Get results
-    results = search.search(query=query, n_results=n_results, **filter_kwargs)
+    def _restaurant_coords(self, name: str):
+        """Get (latitude, longitude) for a restaurant, or None if unknown."""
+        coords = self.coords.get(name)
+        if coords is None:
+            # Fall back to the vector store for names missing from the map
+            restaurant = self.search.get_restaurant_by_name(name, include=('metadatas',))
+            if restaurant:
+                meta = restaurant['metadata']
+                coords = (meta['latitude'], meta['longitude'])
+        return coords
     
-    # Post-filter by time if needed
-    if open_now or open_at_time:
-        madrid_tz = ZoneInfo("Europe/Madrid")
-        check_time = open_at_time if open_at_time else datetime.now(madrid_tz).strftime("%H:%M")
+    def search_restaurants(
+        self,
+        query: str,  # Natural language search query (e.g., "Italian food", "gluten free", "cheap lunch", "north zone")
+        n_results: int = 3,  # Number of results to return
+        price_level: str = None,  # Filter by price: "low", "medium", or "high"
+        zone: str = None,  # Filter by mall zone: "north", "center", or "south"
+        has_vegetarian: bool = None,  # Filter for vegetarian options
+        has_vegan: bool = None,  # Filter for vegan options
+        has_gluten_free: bool = None,  # Filter for gluten-free options
+        has_takeaway: bool = None,  # Filter for takeaway service
+        has_bar: bool = None,  # Filter for restaurants with bar service
+        has_menu: bool = None,  # Filter for restaurants with available menu
+        allow_reservations: bool = None,  # Filter for restaurants that accept reservations
+        open_now: bool = None,  # Filter for restaurants currently open
+        open_at_time: str = None  # Filter for restaurants open at specific time (format: "HH:MM", e.g., "14:30")
+    ) -> str:
+        """Search for restaurants in the mall based on user preferences.
+        
+        Returns formatted restaurant information including descriptions, cuisine types, dietary options, 
+        menu highlights, location zone, services, hours, and contact details."""
+        
+        # Build filter kwargs
+        filter_kwargs = {}
+        if price_level:
+            filter_kwargs['price_level'] = price_level
+        if zone:
+            filter_kwargs['zone'] = zone
+        if has_vegetarian is not None:
+            filter_kwargs['has_vegetarian'] = has_vegetarian
+        if has_vegan is not None:
+            filter_kwargs['has_vegan'] = has_vegan
+        if has_gluten_free is not None:
+            filter_kwargs['has_gluten_free'] = has_gluten_free
+        if has_takeaway is not None:
+            filter_kwargs['has_takeaway'] = has_takeaway
+        if has_bar is not None:
+            filter_kwargs['has_bar'] = has_bar
+        if has_menu is not None:
+            filter_kwargs['has_menu'] = has_menu
+        if allow_reservations is not None:
+            filter_kwargs['allow_reservations'] = allow_reservations
         
-        filtered_results = []
+        # Filter by opening hours in the search itself
+        if open_at_time:
+            try:
+                filter_kwargs['open_at_minutes'] = parse_minutes(open_at_time)
+            except ValueError:
+                return "Invalid time format, use HH:MM"
+        elif open_now:
+            now = datetime.now(_MADRID_TZ)
+            filter_kwargs['open_at_minutes'] = now.hour * 60 + now.minute
+        
+        # Get results
+        results = self.search.search(query=query, n_results=n_results, **filter_kwargs)
+        
+        # Format results for the LLM
+        parts = ["<valid>\n"]
         for result in results:
-            meta = result['metadata']
-            opening = meta.get('opening_time', '')
-            closing = meta.get('closing_time', '')
+            meta = result.metadata
+            doc = result.document
             
-            if opening and closing and opening <= check_time <= closing:
-                filtered_results.append(result)
-        
-        results = filtered_results
-    
-    # Format results for the LLM
-    formatted = "<valid>\n"
-    for result in results:
-        meta = result['metadata']
-        doc = result['document']
-        
-        formatted += f"\n## {meta['name']}\n"
-        formatted += f"{doc}\n"
-        # Only add contact info if available
-        if meta.get('phone'):
-            formatted += f"Phone: {meta['phone']}\n"
-        
-        if meta.get('website_url'):
-            formatted += f"Website: {meta['website_url']}\n"    
+            parts.append(f"\n## {meta['name']}\n")
+            parts.append(f"{doc}\n")
+            # Only add contact info if available
+            if meta.get('phone'):
+                parts.append(f"Phone: {meta['phone']}\n")
             
-    # Close valid tag
-    formatted += "</valid>"
-    
-    return formatted
+            if meta.get('website_url'):
+                parts.append(f"Website: {meta['website_url']}\n")
+                
+        # Close valid tag
+        parts.append("</valid>")
+        
+        return "".join(parts)
 
 
-def get_walking_time(
-    from_restaurant: str,  # Name of starting restaurant
-    to_restaurant: str,  # Name of destination restaurant
-) -> str:
-    """Calculate walking time in minutes between two restaurants in the mall.
-    
-    Returns the estimated walking time rounded to 1 decimal place.
-    Walking speed is calibrated to mall conditions (approximately 69 meters per minute)."""
-    
-    # Initialize search
-    search = RestaurantSearch._instance
-    if search is None:
-        search = RestaurantSearch(db_path="chromadb")
-        search.load_and_index()
-    
-    # Get both restaurants
-    from_rest = search.get_restaurant_by_name(from_restaurant)
-    to_rest = search.get_restaurant_by_name(to_restaurant)
-    
-    # Check if restaurants exist
-    if not from_rest or not to_rest:
-        return "Restaurant not found"
-    
-    # Extract coordinates from metadata
-    from_meta = from_rest['metadata']
-    to_meta = to_rest['metadata']
-    
-    from_lat = from_meta['latitude']
-    from_lon = from_meta['longitude']
-    to_lat = to_meta['latitude']
-    to_lon = to_meta['longitude']
-    
-    # Calculate distance using numpy
-    avg_lat = np.radians((from_lat + to_lat) / 2)
-    lat_m = (to_lat - from_lat) * 111320
-    lon_m = (to_lon - from_lon) * 111320 * np.cos(avg_lat)
-    distance_m = np.sqrt(lat_m**2 + lon_m**2)
-    
-    # Calculate time
-    time_mins = distance_m / 69
-    
-    return f"<valid>\nWalking time from {from_restaurant} to {to_restaurant}: {np.round(time_mins, 1)} minutes\n</valid>"
+    def get_walking_time(
+        self,
+        from_restaurant: str,  # Name of starting restaurant
+        to_restaurant: str,  # Name of destination restaurant
+    ) -> str:
+        """Calculate walking time in minutes between two restaurants in the mall.
+        
+        Returns the estimated walking time rounded to 1 decimal place.
+        Walking speed is calibrated to mall conditions (approximately 69 meters per minute)."""
+        
+        # Get coordinates for both restaurants
+        from_coords = self._restaurant_coords(from_restaurant)
+        to_coords = self._restaurant_coords(to_restaurant)
+        
+        # Check if restaurants exist
+        if not from_coords or not to_coords:
+            return "Restaurant not found"
+        
+        from_lat, from_lon = from_coords
+        to_lat, to_lon = to_coords
+        
+        # Calculate distance (scalar math avoids NumPy overhead for two points)
+        avg_lat = radians((from_lat + to_lat) / 2)
+        lat_m = (to_lat - from_lat) * 111320
+        lon_m = (to_lon - from_lon) * 111320 * cos(avg_lat)
+        distance_m = sqrt(lat_m**2 + lon_m**2)
+        
+        # Calculate time
+        time_mins = distance_m / 69
+        
+        return f"<valid>\nWalking time from {from_restaurant} to {to_restaurant}: {round(time_mins, 1)} minutes\n</valid>"
 
 
-def search_dishes(
-    query: str,  # Natural language search query for specific dishes (e.g., "carbonara", "vegan burger", "tiramisu")
-    n_results: int = 5,  # Number of dish results to return
-    restaurant_name: str = None,  # Filter by specific restaurant name
-    zone: str = None,  # Filter by mall zone: "north", "center", or "south"
-    price_level: str = None,  # Filter by restaurant price: "low", "medium", or "high"
-    has_vegetarian: bool = None,  # Filter for vegetarian dishes only
-    has_vegan: bool = None,  # Filter for vegan dishes only
-    has_gluten_free: bool = None,  # Filter for gluten-free dishes only
-    has_halal: bool = None,  # Filter for halal dishes only
-    has_lactose_free: bool = None,  # Filter for lactose-free dishes only
-    category: str = None,  # Filter by dish category
-) -> str:
-    """Search for specific dishes across all restaurants in the mall.
-    
-    Use this when users ask about specific dishes (like "pasta", "burger", "dessert") rather than general restaurant recommendations.
-    Returns dish information with the restaurant name and location where each dish is available."""
-    
-    # Initialize search
-    search = RestaurantSearch._instance
-    if search is None:
-        search = RestaurantSearch(db_path="chromadb")
-        search.load_and_index()
-    
-    # Build filter kwargs
-    filter_kwargs = {}
-    if restaurant_name:
-        filter_kwargs['restaurant_name'] = restaurant_name
-    if zone:
-        filter_kwargs['zone'] = zone
-    if price_level:
-        filter_kwargs['price_level'] = price_level
-    if has_vegetarian is not None:
-        filter_kwargs['has_vegetarian'] = has_vegetarian
-    if has_vegan is not None:
-        filter_kwargs['has_vegan'] = has_vegan
-    if has_gluten_free is not None:
-        filter_kwargs['has_gluten_free'] = has_gluten_free
-    if has_halal is not None:
-        filter_kwargs['has_halal'] = has_halal
-    if has_lactose_free is not None:
-        filter_kwargs['has_lactose_free'] = has_lactose_free
-    if category:
-        filter_kwargs['category'] = category
-    
-    # Get results
-    results = search.search_dishes(query=query, n_results=n_results, **filter_kwargs)
-    
-    # Format results for the LLM
-    formatted = "<valid>\n"
-    
-    # Group dishes by restaurant for better presentation
-    dishes_by_restaurant = {}
-    for result in results:
-        meta = result['metadata']
-        rest_name = meta.get('restaurant_name', 'Unknown')
-        if rest_name not in dishes_by_restaurant:
-            dishes_by_restaurant[rest_name] = []
-        dishes_by_restaurant[rest_name].append(result)
-    
-    for rest_name, dishes in dishes_by_restaurant.items():
-        formatted += f"\n## At {rest_name}"
-        if dishes and dishes[0]['metadata'].get('zone'):
-            formatted += f" ({dishes[0]['metadata']['zone']} zone)"
-        formatted += "\n"
-        
-        for result in dishes:
-            doc = result['document']
-            formatted += f"- {doc}\n"
-    
-    # Close valid tag
-    formatted += "</valid>"
-    
-    return formatted
+    def search_dishes(
+        self,
+        query: str,  # Natural language search query for specific dishes (e.g., "carbonara", "vegan burger", "tiramisu")
+        n_results: int = 5,  # Number of dish results to return
+        restaurant_name: str = None,  # Filter by specific restaurant name
+        zone: str = None,  # Filter by mall zone: "north", "center", or "south"
+        price_level: str = None,  # Filter by restaurant price: "low", "medium", or "high"
+        has_vegetarian: bool = None,  # Filter for vegetarian dishes only
+        has_vegan: bool = None,  # Filter for vegan dishes only
+        has_gluten_free: bool = None,  # Filter for gluten-free dishes only
+        has_halal: bool = None,  # Filter for halal dishes only
+        has_lactose_free: bool = None,  # Filter for lactose-free dishes only
+        category: str = None,  # Filter by dish category
+    ) -> str:
+        """Search for specific dishes across all restaurants in the mall.
+        
+        Use this when users ask about specific dishes (like "pasta", "burger", "dessert") rather than general restaurant recommendations.
+        Returns dish information with the restaurant name and location where each dish is available."""
+        
+        # Build filter kwargs
+        filter_kwargs = {}
+        if restaurant_name:
+            filter_kwargs['restaurant_name'] = restaurant_name
+        if zone:
+            filter_kwargs['zone'] = zone
+        if price_level:
+            filter_kwargs['price_level'] = price_level
+        if has_vegetarian is not None:
+            filter_kwargs['has_vegetarian'] = has_vegetarian
+        if has_vegan is not None:
+            filter_kwargs['has_vegan'] = has_vegan
+        if has_gluten_free is not None:
+            filter_kwargs['has_gluten_free'] = has_gluten_free
+        if has_halal is not None:
+            filter_kwargs['has_halal'] = has_halal
+        if has_lactose_free is not None:
+            filter_kwargs['has_lactose_free'] = has_lactose_free
+        if category:
+            filter_kwargs['category'] = category
+        
+        # Get results
+        results = self.search.search_dishes(query=query, n_results=n_results, **filter_kwargs)
+        
+        # Format results for the LLM
+        parts = ["<valid>\n"]
+        
+        # Group dishes by restaurant for better presentation
+        dishes_by_restaurant = {}
+        for result in results:
+            meta = result.metadata
+            rest_name = meta.get('restaurant_name', 'Unknown')
+            if rest_name not in dishes_by_restaurant:
+                dishes_by_restaurant[rest_name] = []
+            dishes_by_restaurant[rest_name].append(result)
+        
+        for rest_name, dishes in dishes_by_restaurant.items():
+            parts.append(f"\n## At {rest_name}")
+            if dishes and dishes[0].metadata.get('zone'):
+                parts.append(f" ({dishes[0].metadata['zone']} zone)")
+            parts.append("\n")
+            
+            for result in dishes:
+                doc = result.document
+                parts.append(f"- {doc}\n")
+        
+        # Close valid tag
+        parts.append("</valid>")
+        
+        return "".join(parts)
 
 
 class RestaurantAgent:
     """Chat agent for restaurant recommendations."""
     
-    def __init__(self, model=None, temp=0.5, db_path="chromadb"):
+    def __init__(self, model=None, temp=0.5, db_path=DB_PATH):
         """Initialize the agent.
         
         Args:
             model: LLM model to use (defaults to AGENT_MODEL env var or "claude-haiku-4-5-20251001")
             temp: Temperature for LLM
-            db_path: Path to ChromaDB database
+            db_path: Path to ChromaDB database (defaults to CHROMA_PATH env var or "chromadb")
         """
         if model is None:
             model = os.getenv("AGENT_MODEL", "claude-haiku-4-5-20251001")
         
-        # Initialize search
-        self.search = RestaurantSearch(db_path=db_path)
-        self.search.load_and_index()
+        # Reuse the indexed search backend for this database
+        self.search = get_search(db_path)
+        self.tools = RestaurantTools(self.search)
         
         # Initialize chat
         self.chat = Chat(
             model=model,
             sp=get_system_prompt(),
             temp=temp,
-            tools=[search_restaurants, search_dishes, get_walking_time]
+            tools=[self.tools.search_restaurants, self.tools.search_dishes, self.tools.get_walking_time]
         )
         
         # Add welcome message
@@ -291,6 +302,9 @@ Estoy aquí para ayudarte a encontrar el restaurante perfecto según tus prefere
 """
         )
         self.chat.hist.append(first_message)
+        
+        # Messages shown to the user, kept separately so the UI doesn't filter history
+        self.visible = [first_message]
     
     def __call__(self, message: str):
         """Send a message to the agent and get response.
@@ -301,7 +315,35 @@ Estoy aquí para ayudarte a encontrar el restaurante perfecto según tus prefere
         Returns:
             Agent response
         """
-        return self.chat(message)
+        self.visible.append({'role': 'user', 'content': message})
+        response = self.chat(message)
+        self._show_last_reply()
+        return response
+    
+    def stream(self, message: str):
+        """Send a message to the agent and stream the response.
+        
+        The user message is shown right away and the final reply once the stream ends.
+        
+        Args:
+            message: User message
+        
+        Returns:
+            Generator of response chunks
+        """
+        self.visible.append({'role': 'user', 'content': message})
+        return self._stream_reply(message)
+    
+    def _stream_reply(self, message: str):
+        """Yield response chunks, then show the final reply."""
+        yield from self.chat(message, stream=True)
+        self._show_last_reply()
+    
+    def _show_last_reply(self):
+        """Show the last history message if it is a final assistant reply (no tool calls)."""
+        msg = self.history[-1]
+        if isinstance(msg, Message) and msg.content and not msg.tool_calls:
+            self.visible.append(msg)
     
     @property
     def history(self):
@@ -1,9 +1,11 @@
 """Main FastHTML application for restaurant recommendations."""
 
+import asyncio
+import functools
 import json
 import uuid
-from threading import Thread
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 from fasthtml.common import *
 from starlette.responses import Response, StreamingResponse
@@ -34,21 +36,15 @@ app = FastHTML(hdrs=daisy_hdrs)
 rt = app.route
 
 # Initialize agent (singleton)
-agent = RestaurantAgent(db_path="chromadb")
+agent = RestaurantAgent()
 
 
-def should_show_message(msg):
-    """Determine if a message should be displayed to the user."""
-    # Show user messages (dicts with role='user')
-    if isinstance(msg, dict) and msg.get('role') == 'user':
-        return True
-    
-    
-    # Show assistant Message objects that have content (no tool calls)
-    if isinstance(msg, Message) and msg.content and not msg.tool_calls:
-        return True
-    
-    return False
+@functools.lru_cache(maxsize=1024)
+def render_markdown(content: str) -> str:
+    """Convert markdown to HTML, cached since history is re-rendered on every update."""
+    if not content or not content.strip():
+        return ""
+    return markdown(content)
 
 
 def chat_bubble(msg):
@@ -66,7 +62,7 @@ def chat_bubble(msg):
     color = 'chat-bubble-primary' if is_user else 'chat-bubble-secondary'
     
     # Convert markdown to HTML for display
-    content_html = markdown(content)
+    content_html = render_markdown(content)
     
     return Div(cls=f'chat {placement}')(
         Div(cls='chat-header')(role),
@@ -74,12 +70,12 @@ def chat_bubble(msg):
     )
 
 
-def chat_messages(history):
-    """Render all chat messages."""
+def chat_messages(messages):
+    """Render all visible chat messages."""
     return Div(
         id='chat-messages',
         cls='flex-1 overflow-y-auto p-4 space-y-4'
-    )(*[chat_bubble(msg) for msg in history if should_show_message(msg)])
+    )(*[chat_bubble(msg) for msg in messages])
 
 
 def chat_input():
@@ -124,7 +120,7 @@ def get():
             ),
             
             # Chat area
-            chat_messages(agent.history),
+            chat_messages(agent.visible),
             
             # Input
             Div(id='chat-form-container')(
@@ -159,36 +155,38 @@ def get():
                                 loadingDiv.innerHTML = '<div class="chat-header">assistant</div><div class="chat-bubble chat-bubble-secondary"><span class="loading loading-dots loading-sm"></span></div>';
                                 messagesDiv.appendChild(loadingDiv);
                                 messagesDiv.scrollTop = messagesDiv.scrollHeight;
-                            });
-                            
-                            // Close existing connection
-                            if (eventSource) eventSource.close();
-                            
-                            // Connect to SSE stream
-                            eventSource = new EventSource('/stream/' + streamId);
-                            
-                            eventSource.onmessage = function(e) {
-                                const data = JSON.parse(e.data);
-                                const messagesDiv = document.getElementById('chat-messages');
                                 
-                                if (data.type === 'content') {
-                                    // Update streaming message
-                                    let streamDiv = document.getElementById('streaming-message');
-                                    if (!streamDiv) {
-                                        streamDiv = document.createElement('div');
-                                        streamDiv.id = 'streaming-message';
-                                        streamDiv.className = 'chat chat-start';
-                                        streamDiv.innerHTML = '<div class="chat-header">assistant</div><div class="chat-bubble chat-bubble-secondary"><span class="loading loading-dots loading-sm"></span></div>';
-                                        messagesDiv.appendChild(streamDiv);
+                                // Close existing connection
+                                if (eventSource) eventSource.close();
+                                
+                                // Connect to SSE stream only after the swap, so it can't remove streamed text
+                                eventSource = new EventSource('/stream/' + streamId);
+                                let streamText = '';
+                                
+                                eventSource.onmessage = function(e) {
+                                    const data = JSON.parse(e.data);
+                                    const messagesDiv = document.getElementById('chat-messages');
+                                    
+                                    if (data.type === 'content') {
+                                        // Accumulate deltas and write the whole reply into the bubble
+                                        streamText += data.delta;
+                                        let streamDiv = document.getElementById('streaming-message');
+                                        if (!streamDiv) {
+                                            streamDiv = document.createElement('div');
+                                            streamDiv.id = 'streaming-message';
+                                            streamDiv.className = 'chat chat-start';
+                                            streamDiv.innerHTML = '<div class="chat-header">assistant</div><div class="chat-bubble chat-bubble-secondary"></div>';
+                                            messagesDiv.appendChild(streamDiv);
+                                        }
+                                        streamDiv.querySelector('.chat-bubble').textContent = streamText;
+                                        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+                                    } else if (data.type === 'done') {
+                                        // Close connection and reload messages
+                                        eventSource.close();
+                                        htmx.ajax('GET', '/messages', {target: '#chat-messages', swap: 'innerHTML'});
                                     }
-                                    streamDiv.querySelector('.chat-bubble').textContent = data.content;
-                                    messagesDiv.scrollTop = messagesDiv.scrollHeight;
-                                } else if (data.type === 'done') {
-                                    // Close connection and reload messages
-                                    eventSource.close();
-                                    htmx.ajax('GET', '/messages', {target: '#chat-messages', swap: 'innerHTML'});
-                                }
-                            };
+                                };
+                            });
                         }
                     }
                 });
@@ -197,42 +195,50 @@ def get():
     )
 
 
+# Bounded worker pool for agent calls (no thread spawned per request)
+EXECUTOR = ThreadPoolExecutor(max_workers=32)
+
 # Store active streams
-streams = {}
+streams: dict[str, asyncio.Queue] = {}
+streams_lock = Lock()
+
+
+def process(res_gen, q: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+    """Run the agent's response stream in a worker thread and push stream events to the queue."""
+    def put(msg):
+        loop.call_soon_threadsafe(q.put_nowait, msg)
+    
+    try:
+        for chunk in res_gen:
+            if isinstance(chunk, ModelResponseStream):
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    # Send only the new text; the client appends it
+                    put({'type': 'content', 'delta': delta})
+        
+        # Signal completion
+        put({'type': 'done'})
+    finally:
+        put(None)  # Signal end of stream
+
 
 @rt('/send')
-def post(message: str):
+async def post(message: str):
     """Handle user message - initiate streaming."""
-    # Add user message to history first
-    agent.chat.hist.append({'role': 'user', 'content': message})
+    # Shows the user message now; the stream runs on this agent even if /new-chat rebinds the global
+    res_gen = agent.stream(message)
     
     # Generate stream ID
     stream_id = str(uuid.uuid4())
     
     # Create queue for this stream
-    q = Queue()
-    streams[stream_id] = q
-    
-    # Start background thread to process message
-    def process():
-        # Stream response (message already in history)
-        res_gen = agent.chat('', stream=True)  # Empty since message already added
-        content = ""
-        
-        try:
-            for chunk in res_gen:
-                if isinstance(chunk, ModelResponseStream):
-                    delta = chunk.choices[0].delta.content
-                    if delta:
-                        content += delta
-                        q.put({'type': 'content', 'content': content})
-            
-            # Signal completion
-            q.put({'type': 'done'})
-        finally:
-            q.put(None)  # Signal end of stream
+    q = asyncio.Queue()
+    with streams_lock:
+        streams[stream_id] = q
     
-    Thread(target=process, daemon=True).start()
+    # Process message on the worker pool
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(EXECUTOR, process, res_gen, q, loop)
     
     # Return response with stream ID in header
     return Response('', headers={'X-Stream-Id': stream_id})
@@ -241,20 +247,22 @@ def post(message: str):
 @rt('/stream/{stream_id}')
 def get_stream(stream_id: str):
     """SSE endpoint for streaming responses."""
-    def generate():
-        q = streams.get(stream_id)
+    async def generate():
+        with streams_lock:
+            q = streams.get(stream_id)
         if not q:
             return
         
         try:
             while True:
-                msg = q.get()
+                msg = await q.get()
                 if msg is None:
                     break
-                yield f"data: {json.dumps(msg)}\n\n"
+                yield f"data: {json.dumps(msg, separators=(',', ':'))}\n\n"
         finally:
             # Cleanup
-            streams.pop(stream_id, None)
+            with streams_lock:
+                streams.pop(stream_id, None)
     
     return StreamingResponse(generate(), media_type='text/event-stream')
 
@@ -262,7 +270,7 @@ def get_stream(stream_id: str):
 @rt('/messages')
 def get_messages():
     """Get current chat messages."""
-    return chat_messages(agent.history)
+    return chat_messages(agent.visible)
 
 
 @rt('/new-chat')
@@ -270,9 +278,9 @@ def post():
     """Reset the chat history and return empty chat."""
     # Re-initialize agent to get fresh system prompt
     global agent
-    agent = RestaurantAgent(db_path="chromadb")
+    agent = RestaurantAgent()
     
-    return chat_messages(agent.history)
+    return chat_messages(agent.visible)
 
 
 if __name__ == '__main__':
@@ -2,19 +2,28 @@
 
 from .data_loader import (
     load_restaurant_data,
+    parse_minutes,
+    build_dish_highlights,
     make_restaurant_doc_with_dishes,
     make_metadata,
+    build_metadata_list,
     make_dish_doc,
+    build_restaurant_lookup,
     make_dish_metadata,
 )
-from .search import RestaurantVectorStore, DishVectorStore, RestaurantSearch
+from .search import SearchHit, RestaurantVectorStore, DishVectorStore, RestaurantSearch
 
 __all__ = [
     'load_restaurant_data',
+    'parse_minutes',
+    'build_dish_highlights',
     'make_restaurant_doc_with_dishes',
     'make_metadata',
+    'build_metadata_list',
     'make_dish_doc',
+    'build_restaurant_lookup',
     'make_dish_metadata',
+    'SearchHit',
     'RestaurantVectorStore',
     'DishVectorStore',
     'RestaurantSearch',
@@ -1,36 +1,106 @@
 """Data loading and document building functionality for restaurant and dish data."""
 
+import hashlib
+import os
+from datetime import time
 import httpx
 import pandas as pd
 from io import BytesIO
-from typing import Dict, Tuple, Any
+from pathlib import Path
+from typing import Dict, List, Tuple, Any, Optional
 
 
 SHEET_ID = "13h-DvmpyZSa522PVam7rmqcbAXwuB3blSkKye4Wx6qc"
+CACHE_DIR = Path.home() / ".cache" / "agent"
+# Bump when the processing of cached frames changes (columns, zone patch, dtypes)
+SHEET_CACHE_VERSION = 2
 
+# Sheets and columns used to build the restaurant and dish DataFrames
+SHEET_COLUMNS = {
+    'restaurants': [
+        'id', 'name', 'website_url', 'phone', 'description_short', 'description_long',
+        'price_level', 'cuisines', 'dietary_tags', 'services', 'allow_reservations',
+        'opening_hours', 'has_menu', 'zone', 'lat', 'lng',
+    ],
+    'restaurant_dishes': ['restaurant_id', 'dish_id', 'weight', 'updated_at'],
+    'dish_keywords': ['id', 'text', 'category', 'dietary_tags'],
+}
 
-def load_restaurant_data(sheet_id: str = SHEET_ID) -> Tuple[pd.DataFrame, pd.DataFrame]:
+# Default for arguments where None is a meaningful value
+_UNSET = object()
+
+# Rust-based calamine reader (python-calamine) is much faster than openpyxl
+EXCEL_ENGINE = "calamine"
+
+
+def get_sheet_version(sheet_id: str = SHEET_ID) -> Optional[str]:
+    """
+    Get the current version of the Google Sheet without downloading it.
+    
+    Args:
+        sheet_id: Google Sheets ID to check
+        
+    Returns:
+        ETag or Last-Modified header value, or None if unavailable
+    """
+    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
+    try:
+        r = httpx.head(url, follow_redirects=True)
+    except httpx.HTTPError as e:
+        print(f"Error checking sheet version: {e}")
+        return None
+    if not r.is_success:
+        print(f"Error checking sheet version: HTTP {r.status_code}")
+        return None
+    return r.headers.get('etag') or r.headers.get('last-modified')
+
+
+def load_restaurant_data(sheet_id: str = SHEET_ID, version: Any = _UNSET) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Load restaurant and dish data from Google Sheets.
     
+    Parsed DataFrames are cached on disk per sheet version and SHEET_CACHE_VERSION,
+    so the xlsx is only downloaded and parsed when the sheet or the processing changes. Set AGENT_SHEET_REFRESH=1 to
+    bypass the cache.
+    
     Args:
         sheet_id: Google Sheets ID to load data from
+        version: Sheet version from get_sheet_version (None if unknown, which skips
+            the cache); checked here if not given
         
     Returns:
         Tuple of (restaurants_df, dishes_df) DataFrames
     """
+    # Check the on-disk cache for this sheet version
+    if version is _UNSET:
+        version = get_sheet_version(sheet_id)
+    cache_path = None
+    if version:
+        key = hashlib.sha256(f"{SHEET_CACHE_VERSION}:{sheet_id}:{version}".encode()).hexdigest()[:16]
+        cache_path = CACHE_DIR / f"{key}.pkl"
+        if cache_path.exists() and os.getenv("AGENT_SHEET_REFRESH") != "1":
+            try:
+                return pd.read_pickle(cache_path)
+            except Exception as e:
+                # Unreadable cache (e.g. from an older pandas); download again
+                print(f"Error reading cached restaurant data: {e}")
+    
     url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
     r = httpx.get(url, follow_redirects=True)
-    sheets = pd.read_excel(BytesIO(r.content), sheet_name=None)
+    
+    # Parse only the sheets and columns we use
+    with pd.ExcelFile(BytesIO(r.content), engine=EXCEL_ENGINE) as xls:
+        sheets = {
+            name: xls.parse(name, usecols=lambda col, cols=cols: col in cols)
+            for name, cols in SHEET_COLUMNS.items()
+            if name in xls.sheet_names
+        }
     
     df_restaurants = sheets['restaurants']
     
     # Handle dishes - merge restaurant_dishes with dish_keywords and restaurant names
     if 'restaurant_dishes' in sheets and 'dish_keywords' in sheets:
-        cols = ['restaurant_id', 'dish_id', 'weight', 'updated_at']
-        df_rest_dishes = sheets['restaurant_dishes'][cols]
-        
-        df_dishes = df_rest_dishes.merge(
+        df_dishes = sheets['restaurant_dishes'].merge(
             sheets['dish_keywords'], 
             left_on='dish_id', 
             right_on='id',
@@ -66,22 +136,56 @@ def load_restaurant_data(sheet_id: str = SHEET_ID) -> Tuple[pd.DataFrame, pd.Dat
         'Rocambolesc': {'zone': 'north', 'lat': 41.611882, 'lng': 2.344658},
     }
     
-    if 'zone' not in df_restaurants.columns:
-        df_restaurants['zone'] = None
-    if 'lat' not in df_restaurants.columns:
-        df_restaurants['lat'] = None
-    if 'lng' not in df_restaurants.columns:
-        df_restaurants['lng'] = None
+    # Align on restaurant name and patch all known locations in one update;
+    # object dtype lets string zones land in a column the sheet left empty,
+    # while lat/lng stay float
+    zone_df = pd.DataFrame.from_dict(zone_data, orient='index')
+    columns = df_restaurants.columns.union(zone_df.columns, sort=False)
+    df_restaurants = df_restaurants.reindex(columns=columns)
+    df_restaurants['zone'] = df_restaurants['zone'].astype(object)
+    df_restaurants = df_restaurants.set_index('name')
+    df_restaurants.update(zone_df)
+    df_restaurants = df_restaurants.reset_index()[columns]
     
-    for idx, row in df_restaurants.iterrows():
-        if row['name'] in zone_data:
-            df_restaurants.at[idx, 'zone'] = zone_data[row['name']]['zone']
-            df_restaurants.at[idx, 'lat'] = zone_data[row['name']]['lat']
-            df_restaurants.at[idx, 'lng'] = zone_data[row['name']]['lng']
+    if cache_path is not None:
+        # Write to a temp file and swap it in, so an interrupted write never leaves a partial pickle
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle((df_restaurants, df_dishes), tmp_path)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Error caching restaurant data: {e}")
+            tmp_path.unlink(missing_ok=True)
     
     return df_restaurants, df_dishes
 
 
+def parse_minutes(hhmm: str) -> int:
+    """
+    Convert an "HH:MM" time string to minutes since midnight.
+    
+    Args:
+        hhmm: Time string (e.g., "14:30")
+        
+    Returns:
+        Minutes since midnight
+        
+    Raises:
+        ValueError: If the string is not in HH:MM format
+    """
+    # C-implemented ISO parser handles the common "HH:MM" case
+    try:
+        parsed = time.fromisoformat(hhmm)
+    except ValueError:
+        # Fall back for non-ISO input such as "9:30", padded strings or "24:00"
+        hours, minutes = (int(part) for part in hhmm.strip().split(':'))
+        if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes):
+            raise ValueError(f"Invalid time: {hhmm!r}")
+        return hours * 60 + minutes
+    return parsed.hour * 60 + parsed.minute
+
+
 def load_all_sheets(sheet_id: str = SHEET_ID) -> Dict[str, pd.DataFrame]:
     """
     Load all sheets from Google Sheets.
@@ -98,14 +202,46 @@ def load_all_sheets(sheet_id: str = SHEET_ID) -> Dict[str, pd.DataFrame]:
     return sheets
 
 
-def make_restaurant_doc_with_dishes(row: pd.Series, df_dishes: pd.DataFrame, top_n: int = 10) -> str:
+def build_dish_highlights(df_dishes: pd.DataFrame, top_n: int = 10) -> Dict[int, str]:
+    """
+    Format the top dishes of every restaurant in one grouped pass.
+    
+    Args:
+        df_dishes: DataFrame with all dishes, ordered by restaurant and weight
+        top_n: Number of top dishes to include per restaurant
+        
+    Returns:
+        Dictionary mapping restaurant ID to its "Menu highlights" text
+    """
+    if df_dishes.empty:
+        return {}
+    
+    top = df_dishes.groupby('restaurant_id', sort=False).head(top_n)
+    
+    # Dish text with dietary tags appended when available
+    text_col = 'text' if 'text' in top.columns else 'name'
+    if text_col in top.columns:
+        text = top[text_col].fillna('Unknown dish').astype(str)
+    else:
+        text = pd.Series('Unknown dish', index=top.index)
+    if 'dietary_tags' in top.columns:
+        tags = top['dietary_tags']
+        text = text.where(tags.isna(), text + ' (' + tags.astype(str) + ')')
+    
+    lines = '- ' + text
+    return {
+        int(restaurant_id): "\nMenu highlights: " + " ".join(group)
+        for restaurant_id, group in lines.groupby(top['restaurant_id'], sort=False)
+    }
+
+
+def make_restaurant_doc_with_dishes(row: pd.Series, dish_highlights: Dict[int, str]) -> str:
     """
     Create a searchable description for a restaurant with top dishes.
     
     Args:
-        row: Restaurant row from DataFrame
-        df_dishes: DataFrame with all dishes
-        top_n: Number of top dishes to include
+        row: Restaurant row from DataFrame (Series or dict)
+        dish_highlights: Highlights text per restaurant ID from build_dish_highlights
         
     Returns:
         Formatted restaurant document string
@@ -119,21 +255,76 @@ def make_restaurant_doc_with_dishes(row: pd.Series, df_dishes: pd.DataFrame, top
         f"Dietary options available: {row.get('dietary_tags')}." if pd.notna(row.get('dietary_tags')) else "",
         f"Services: {row.get('services')}." if pd.notna(row.get('services')) else "",
         f"Open {row.get('opening_hours')}." if pd.notna(row.get('opening_hours')) else "",
+        dish_highlights.get(row['id'], ""),
     ]
     
-    # Get top dishes for this restaurant
-    rest_dishes = df_dishes[df_dishes['restaurant_id'] == row['id']].head(top_n)
+    return " ".join(p for p in parts if p)
+
+
+def _column(df: pd.DataFrame, name: str, default: Any) -> pd.Series:
+    """Get a column, or a constant Series if the sheet doesn't have it."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index)
+
+
+def _safe_minutes(hhmm: str) -> int:
+    """Parse HH:MM to minutes, returning -1 (never matches) when invalid."""
+    try:
+        return parse_minutes(hhmm)
+    except ValueError:
+        return -1
+
+
+def build_metadata_list(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Create metadata dictionaries for all restaurants at once.
     
-    if len(rest_dishes) > 0:
-        parts.append("\nMenu highlights:")
-        for _, dish in rest_dishes.iterrows():
-            dish_text = dish.get('text', dish.get('name', 'Unknown dish'))
-            # Add dietary tags to each dish if available
-            if pd.notna(dish.get('dietary_tags')):
-                dish_text += f" ({dish.get('dietary_tags')})"
-            parts.append(f"- {dish_text}")
+    Tag and service flags are computed column-wise with pandas string
+    methods instead of per-row Python string operations.
     
-    return " ".join(p for p in parts if p)
+    Args:
+        df: Restaurants DataFrame
+        
+    Returns:
+        List of restaurant metadata dictionaries, one per row
+    """
+    dietary = _column(df, 'dietary_tags', '').astype(str).str.lower()
+    services = _column(df, 'services', '').astype(str).str.lower()
+    zone = _column(df, 'zone', None)
+    
+    # Parse opening hours ("HH:MM-HH:MM")
+    hours = _column(df, 'opening_hours', None)
+    has_range = hours.notna() & hours.astype(str).str.contains('-', regex=False)
+    times = hours[has_range].astype(str).str.split('-')
+    opening = times.str[0].str.strip().reindex(df.index, fill_value='').tolist()
+    closing = times.str[1].str.strip().reindex(df.index, fill_value='').tolist()
+    
+    columns = {
+        "restaurant_id": df['id'].astype(int).tolist(),
+        "name": df['name'].tolist(),
+        "price_level": _column(df, 'price_level', '').tolist(),
+        "zone": zone.where(zone.notna(), '').tolist(),
+        "latitude": _column(df, 'lat', None).astype(float).fillna(0.0).tolist(),
+        "longitude": _column(df, 'lng', None).astype(float).fillna(0.0).tolist(),
+        "has_vegetarian": dietary.str.contains('vegetarian', regex=False).tolist(),
+        "has_vegan": dietary.str.contains('vegan', regex=False).tolist(),
+        "has_gluten_free": dietary.str.contains('gluten_free', regex=False).tolist(),
+        "has_menu": _column(df, 'has_menu', False).astype(bool).tolist(),
+        "allow_reservations": _column(df, 'allow_reservations', False).astype(bool).tolist(),
+        "has_takeaway": services.str.contains('takeaway', regex=False).tolist(),
+        "has_bar": services.str.contains('bar', regex=False).tolist(),
+        "phone": _column(df, 'phone', '').tolist(),
+        "website_url": _column(df, 'website_url', '').tolist(),
+        "opening_time": opening,
+        "closing_time": closing,
+        # Minutes since midnight for range filters; -1 never matches an open-at query
+        "opening_minutes": [_safe_minutes(t) for t in opening],
+        "closing_minutes": [_safe_minutes(t) for t in closing],
+    }
+    
+    keys = list(columns)
+    return [dict(zip(keys, values)) for values in zip(*columns.values())]
 
 
 def make_metadata(row: pd.Series) -> Dict[str, Any]:
@@ -146,33 +337,7 @@ def make_metadata(row: pd.Series) -> Dict[str, Any]:
     Returns:
         Dictionary with restaurant metadata
     """
-    # Parse opening hours
-    opening_time = ""
-    closing_time = ""
-    if pd.notna(row.get('opening_hours')) and '-' in str(row.get('opening_hours')):
-        times = str(row.get('opening_hours')).split('-')
-        opening_time = times[0].strip()
-        closing_time = times[1].strip()
-    
-    return {
-        "restaurant_id": int(row['id']),
-        "name": row['name'],
-        "price_level": row.get('price_level', ''),
-        "zone": row.get('zone', '') if pd.notna(row.get('zone')) else "",
-        "latitude": float(row.get('lat', 0)) if pd.notna(row.get('lat')) else 0.0,
-        "longitude": float(row.get('lng', 0)) if pd.notna(row.get('lng')) else 0.0,
-        "has_vegetarian": "vegetarian" in str(row.get('dietary_tags', '')).lower(),
-        "has_vegan": "vegan" in str(row.get('dietary_tags', '')).lower(),
-        "has_gluten_free": "gluten_free" in str(row.get('dietary_tags', '')).lower(),
-        "has_menu": bool(row.get('has_menu', False)),
-        "allow_reservations": bool(row.get('allow_reservations', False)),
-        "has_takeaway": "takeaway" in str(row.get('services', '')).lower(),
-        "has_bar": "bar" in str(row.get('services', '')).lower(),
-        "phone": row.get('phone', ''),
-        "website_url": row.get('website_url', ''),
-        "opening_time": opening_time,
-        "closing_time": closing_time,
-    }
+    return build_metadata_list(row.to_frame().T)[0]
 
 
 def make_dish_doc(row: pd.Series) -> str:
@@ -180,7 +345,7 @@ def make_dish_doc(row: pd.Series) -> str:
     Create a searchable description for a dish.
     
     Args:
-        row: Dish row from merged DataFrame
+        row: Dish row from merged DataFrame (Series or dict)
         
     Returns:
         Formatted dish document string
@@ -194,19 +359,33 @@ def make_dish_doc(row: pd.Series) -> str:
     return " ".join(p for p in parts if p)
 
 
-def make_dish_metadata(row: pd.Series, df_restaurants: pd.DataFrame) -> Dict[str, Any]:
+def build_restaurant_lookup(df_restaurants: pd.DataFrame) -> Dict[int, Dict[str, Any]]:
+    """
+    Map restaurant IDs to their row as a dict, for per-dish enrichment.
+    
+    Args:
+        df_restaurants: DataFrame with restaurant data
+        
+    Returns:
+        Dictionary of restaurant row dicts keyed by restaurant ID
+    """
+    # Keep the first row per ID, like the old per-dish filter did
+    return df_restaurants.drop_duplicates('id').set_index('id').to_dict('index')
+
+
+def make_dish_metadata(row: pd.Series, rest_lookup: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
     """
     Create metadata dictionary for a dish.
     
     Args:
-        row: Dish row from merged DataFrame
-        df_restaurants: DataFrame with restaurant data for enrichment
+        row: Dish row from merged DataFrame (Series or dict)
+        rest_lookup: Restaurant rows by ID from build_restaurant_lookup
         
     Returns:
         Dictionary with dish metadata
     """
     # Get restaurant info
-    restaurant = df_restaurants[df_restaurants['id'] == row['restaurant_id']].iloc[0] if not df_restaurants[df_restaurants['id'] == row['restaurant_id']].empty else None
+    restaurant = rest_lookup.get(row['restaurant_id'])
     
     # The restaurant name comes from the merge - it's in the 'name' column
     restaurant_name = row.get('name', '')
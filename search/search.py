@@ -1,11 +1,479 @@
 """Restaurant search functionality with vector store."""
 
+import asyncio
+import dbm
+import functools
+import hashlib
+import json
+import numbers
+import operator
+import os
+import shelve
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import chromadb
 from chromadb.api.models.Collection import Collection
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from importlib.util import find_spec
+from pathlib import Path
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+from .data_loader import CACHE_DIR, SHEET_ID, get_sheet_version, load_restaurant_data, build_dish_highlights, make_restaurant_doc_with_dishes, build_metadata_list, make_dish_doc, build_restaurant_lookup, make_dish_metadata
+
+
+UPSERT_BATCH_SIZE = 200  # Small writes keep SQLite transactions short
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 128  # Documents per forward pass on the GPU
+EMBEDDING_CACHE_PATH = CACHE_DIR / "embeddings"
+QUERY_CACHE_SIZE = 512
+INDEX_MARKER = ".indexed.json"  # Written to the DB directory after a full index
+# Bump when stored documents or metadata change shape; older indexes are rebuilt on load
+INDEX_SCHEMA_VERSION = 2
+
+# Serializes model calls and cache file access when both stores index concurrently
+_EMBEDDING_LOCK = threading.Lock()
+
+# "flat" ranks the whole (small) collection exactly in NumPy; "chroma" uses ChromaDB's HNSW query
+DEFAULT_SEARCH_BACKEND = "flat"
+
+_WHERE_OPERATORS = {
+    '$eq': operator.eq,
+    '$ne': operator.ne,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+    '$in': lambda column, options: column.isin(options),
+}
+# Negated operators match wherever their counterpart doesn't, including documents without the key
+_NEGATED_OPERATORS = {'$ne': '$eq', '$nin': '$in'}
+
+# Searches run concurrently through RestaurantSearch.asearch / asearch_dishes
+SEARCH_WORKERS = 4
+
+# Filters matching at most this many documents are sent to ChromaDB as an ID list
+PREFILTER_MAX_IDS = 1000
+
+
+class SearchHit(NamedTuple):
+    """A single search result."""
+    
+    id: str
+    document: str
+    metadata: Dict[str, Any]
+    distance: Optional[float]
 
-from .data_loader import load_restaurant_data, make_restaurant_doc_with_dishes, make_metadata, make_dish_doc, make_dish_metadata
+
+def to_search_hits(results: Dict[str, Any]) -> List[SearchHit]:
+    """
+    Convert a ChromaDB-shaped query result for one query into hits.
+    
+    Args:
+        results: Result of a vector store search
+        
+    Returns:
+        List of hits, best match first
+    """
+    if not results['ids'] or not results['ids'][0]:
+        return []
+    
+    ids = results['ids'][0]
+    distances = results['distances'][0] if results.get('distances') else [None] * len(ids)
+    return [
+        SearchHit(*hit)
+        for hit in zip(ids, results['documents'][0], results['metadatas'][0], distances)
+    ]
+
+
+def _bool_rows(column: pd.Series) -> np.ndarray:
+    """Flag the rows of a metadata column that hold booleans."""
+    if pd.api.types.is_bool_dtype(column):
+        return np.ones(len(column), dtype=bool)
+    if column.dtype == object:
+        return column.map(lambda value: isinstance(value, bool)).to_numpy(dtype=bool)
+    return np.zeros(len(column), dtype=bool)
+
+
+def _apply_operator(column: pd.Series, op: str, operand: Any) -> np.ndarray:
+    """
+    Evaluate one where operator over a metadata column.
+    
+    Booleans only match booleans, as in ChromaDB, although True == 1 in Python.
+    
+    Args:
+        column: Metadata values, NaN where a document lacks the key
+        op: Operator such as "$eq" or "$in"
+        operand: Value (or list of values for "$in") to compare against
+        
+    Returns:
+        Boolean array, True for rows that satisfy the condition
+    """
+    if op in _NEGATED_OPERATORS:
+        return ~_apply_operator(column, _NEGATED_OPERATORS[op], operand)
+    
+    matched = np.asarray(_WHERE_OPERATORS[op](column, operand), dtype=bool)
+    options = operand if op == '$in' else [operand]
+    if not any(isinstance(option, numbers.Number) for option in options):
+        return matched  # Strings never compare equal to booleans
+    
+    # ChromaDB requires every value in an "$in" list to have the same type
+    return matched & (_bool_rows(column) == isinstance(options[0], bool))
+
+
+def where_mask(frame: pd.DataFrame, where: Dict[str, Any]) -> np.ndarray:
+    """
+    Evaluate a ChromaDB-style where filter over many metadata dicts at once.
+    
+    Args:
+        frame: Metadata with one row per document and one column per key
+        where: Filter such as {"zone": "north"} or {"$and": [...]}
+        
+    Returns:
+        Boolean array, True for rows that satisfy the filter. Comparing values
+        of incompatible types (e.g. "$gt" on strings vs numbers) matches nothing.
+    """
+    mask = np.ones(len(frame), dtype=bool)
+    for key, condition in where.items():
+        if key == '$and':
+            for c in condition:
+                mask &= where_mask(frame, c)
+        elif key == '$or':
+            mask &= np.logical_or.reduce([where_mask(frame, c) for c in condition])
+        else:
+            if key in frame.columns:
+                column = frame[key]
+            else:
+                column = pd.Series(None, index=frame.index, dtype=object)
+            present = column.notna().to_numpy()
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for op, operand in condition.items():
+                try:
+                    matched = _apply_operator(column, op, operand)
+                except TypeError:
+                    return np.zeros(len(frame), dtype=bool)
+                # Documents without the key only match negated operators, like in ChromaDB
+                mask &= (matched | ~present) if op in _NEGATED_OPERATORS else (matched & present)
+    return mask
+
+
+def load_metadata_frame(collection: Collection) -> pd.DataFrame:
+    """Load a collection's metadata as a DataFrame indexed by document ID."""
+    data = collection.get(include=['metadatas'])
+    return pd.DataFrame(data['metadatas'], index=data['ids'])
+
+
+def empty_query_result() -> Dict[str, Any]:
+    """Get a ChromaDB-shaped query result with no matches."""
+    return {'ids': [[]], 'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+
+
+@functools.lru_cache(maxsize=8)
+def _get_client(db_path: str) -> chromadb.ClientAPI:
+    """Get the ChromaDB client for a path, shared by every store using it."""
+    return chromadb.PersistentClient(path=db_path)
+
+
+def get_search_backend() -> str:
+    """Get the search backend from AGENT_BACKEND, read per call so .env loaded after import applies."""
+    return os.getenv("AGENT_BACKEND", DEFAULT_SEARCH_BACKEND)
+
+
+class SentenceTransformerEmbedder:
+    """Batched sentence-transformers encoder returning unit-length vectors."""
+    
+    def __init__(self, model_name: str = EMBEDDING_MODEL, device: str = "cuda", batch_size: int = EMBEDDING_BATCH_SIZE):
+        """
+        Load the model.
+        
+        Args:
+            model_name: sentence-transformers model to load
+            device: Torch device to run on
+            batch_size: Number of texts encoded per forward pass
+        """
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+    
+    def __call__(self, input: List[str]) -> np.ndarray:
+        """Encode texts into a float32 matrix with one row per text."""
+        embeddings = self.model.encode(
+            list(input),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return embeddings.astype(np.float32, copy=False)
+
+
+@functools.cache
+def get_embedding_function():
+    """
+    Get the embedding function used for documents and queries.
+    
+    Uses sentence-transformers on the GPU when it and CUDA are available, and
+    ChromaDB's bundled ONNX build of the same model otherwise (faster on CPU).
+    Both return L2-normalized vectors. The model is loaded once and shared.
+    
+    Returns:
+        Callable mapping a list of texts to a list of embeddings
+    """
+    if find_spec("sentence_transformers") and find_spec("torch"):
+        import torch
+        if torch.cuda.is_available():
+            return SentenceTransformerEmbedder(EMBEDDING_MODEL, device="cuda")
+    return DefaultEmbeddingFunction()
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_normalized_query(query: str) -> np.ndarray:
+    """Embed a normalized query once; the cached vector is read-only."""
+    vector = np.asarray(get_embedding_function()([query])[0], dtype=np.float32)
+    vector.setflags(write=False)
+    return vector
+
+
+def embed_query(query: str) -> np.ndarray:
+    """
+    Embed a search query, reusing recent results.
+    
+    Queries are stripped and case-folded first (the model is uncased), so
+    repeats like "Pasta " and "pasta" share a cache entry.
+    
+    Args:
+        query: Search query text
+        
+    Returns:
+        Read-only float32 query embedding
+    """
+    return _embed_normalized_query(query.strip().casefold())
+
+
+def embed_documents(embedding_function, documents: List[str]) -> np.ndarray:
+    """
+    Embed documents, reusing vectors cached on disk by content hash.
+    
+    The cache is shared by both stores, so re-indexing only runs the model
+    on documents that changed.
+    
+    Args:
+        embedding_function: Function mapping a list of documents to embeddings
+        documents: Documents to embed
+        
+    Returns:
+        Float32 matrix with one embedding per document
+    """
+    keys = [hashlib.sha256(f"{EMBEDDING_MODEL}:{doc}".encode()).hexdigest() for doc in documents]
+    
+    with _EMBEDDING_LOCK:
+        try:
+            EMBEDDING_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            cache = shelve.open(str(EMBEDDING_CACHE_PATH))
+        except (OSError, *dbm.error) as e:
+            print(f"Error opening embedding cache: {e}")
+            return np.asarray(embedding_function(documents), dtype=np.float32)
+        
+        with cache:
+            missing = {key: doc for key, doc in zip(keys, documents) if key not in cache}
+            if missing:
+                vectors = embedding_function(list(missing.values()))
+                for key, vector in zip(missing, vectors):
+                    cache[key] = np.asarray(vector, dtype=np.float32)
+            return np.stack([cache[key] for key in keys])
+
+
+def upsert_in_batches(
+    collection: Collection,
+    embedding_function,
+    documents: List[str],
+    metadatas: List[Dict[str, Any]],
+    ids: List[str],
+    batch_size: int = UPSERT_BATCH_SIZE
+) -> None:
+    """
+    Embed all documents in one pass (see embed_documents), then upsert them in batches.
+    
+    Args:
+        collection: Collection to write to
+        embedding_function: Function mapping a list of documents to embeddings
+        documents: Documents to index
+        metadatas: Metadata for each document
+        ids: ID for each document
+        batch_size: Maximum number of documents per upsert call
+    """
+    if not ids:
+        return
+    
+    embeddings = embed_documents(embedding_function, documents)
+    
+    for i in range(0, len(ids), batch_size):
+        collection.upsert(
+            ids=ids[i:i + batch_size],
+            embeddings=embeddings[i:i + batch_size].tolist(),
+            documents=documents[i:i + batch_size],
+            metadatas=metadatas[i:i + batch_size]
+        )
+
+
+def combine_where(filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Build a where clause from per-field conditions.
+    
+    ChromaDB only accepts one field per where dict, so multiple
+    conditions are wrapped in "$and".
+    
+    Args:
+        filters: Mapping of metadata field to value or operator dict
+        
+    Returns:
+        Where clause, or None if there are no filters
+    """
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters
+    return {"$and": [{key: condition} for key, condition in filters.items()]}
+
+
+class FlatIndex:
+    """Exact inner-product search over an in-memory copy of a collection."""
+    
+    def __init__(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        embeddings: Any
+    ):
+        """
+        Initialize the index with L2-normalized embeddings.
+        
+        Args:
+            ids: Document IDs
+            documents: Document texts
+            metadatas: Document metadata dicts
+            embeddings: Embedding matrix with one row per document
+        """
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self.metadata_frame = pd.DataFrame(metadatas)
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(ids) > 0:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        self.vectors = vectors
+    
+    @classmethod
+    def from_collection(cls, collection: Collection) -> "FlatIndex":
+        """Load every document and embedding from a ChromaDB collection."""
+        data = collection.get(include=['embeddings', 'documents', 'metadatas'])
+        embeddings = data['embeddings'] if data['embeddings'] is not None else []
+        return cls(data['ids'], data['documents'], data['metadatas'], embeddings)
+    
+    def search(
+        self,
+        query_embedding: Any,
+        n_results: int = 5,
+        where: Optional[Dict[str, Any]] = None,
+        ids: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Rank documents by cosine similarity to the query embedding.
+        
+        Args:
+            query_embedding: L2-normalized embedding of the query text
+            n_results: Number of results to return
+            where: ChromaDB-style metadata filter
+            ids: Only rank these document IDs
+            
+        Returns:
+            Dictionary shaped like a ChromaDB query result. Distances are squared
+            L2 between unit vectors, matching ChromaDB's default "l2" space.
+        """
+        if ids is not None:
+            candidates = np.array([self.positions[i] for i in ids if i in self.positions], dtype=int)
+        else:
+            candidates = np.arange(len(self.ids))
+        if where:
+            candidates = candidates[where_mask(self.metadata_frame, where)[candidates]]
+        
+        if len(candidates) == 0:
+            return empty_query_result()
+        
+        # Query embeddings are already unit length, so the dot product is the cosine.
+        # Unfiltered searches use the matrix in place rather than gathering a copy
+        vectors = self.vectors if ids is None and not where else self.vectors[candidates]
+        scores = vectors @ np.asarray(query_embedding, dtype=np.float32)
+        order = np.argsort(-scores, kind='stable')[:n_results]
+        top = candidates[order]
+        
+        return {
+            'ids': [[self.ids[i] for i in top]],
+            'documents': [[self.documents[i] for i in top]],
+            'metadatas': [[self.metadatas[i] for i in top]],
+            'distances': [[float(2 - 2 * score) for score in scores[order]]],
+        }
+
+
+def search_store(
+    store: Any,
+    query: str,
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    where_document: Optional[Dict[str, Any]] = None,
+    ids: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Search a vector store with the backend chosen by AGENT_BACKEND.
+    
+    The flat backend ranks an in-memory FlatIndex built lazily from the
+    collection. The chroma backend resolves selective filters to an ID list
+    from cached metadata before querying ChromaDB.
+    
+    Args:
+        store: RestaurantVectorStore or DishVectorStore to search
+        query: Search query text
+        n_results: Number of results to return
+        where: Filter on metadata
+        where_document: Filter on document content
+        ids: Only search these document IDs
+        
+    Returns:
+        Dictionary shaped like a ChromaDB query result
+    """
+    # Embeddings are always computed here, so the collection's own embedder is never used
+    query_embedding = embed_query(query)
+    
+    if get_search_backend() == "flat" and where_document is None:
+        if store.flat_index is None:
+            store.flat_index = FlatIndex.from_collection(store.collection)
+        return store.flat_index.search(query_embedding, n_results=n_results, where=where, ids=ids)
+    
+    # Resolve selective filters to an ID list from cached metadata
+    if where:
+        if store.metadata_frame is None:
+            store.metadata_frame = load_metadata_frame(store.collection)
+        frame = store.metadata_frame if ids is None else store.metadata_frame[store.metadata_frame.index.isin(ids)]
+        matched = frame.index[where_mask(frame, where)].tolist()
+        if not matched:
+            return empty_query_result()
+        if len(matched) <= PREFILTER_MAX_IDS:
+            ids, where = matched, None
+    
+    return store.collection.query(
+        query_embeddings=[query_embedding.tolist()],
+        ids=ids,
+        n_results=n_results,
+        where=where,
+        where_document=where_document
+    )
 
 
 class RestaurantVectorStore:
@@ -21,8 +489,11 @@ class RestaurantVectorStore:
         """
         self.db_path = db_path
         self.collection_name = collection_name
-        self.client = chromadb.PersistentClient(path=db_path)
-        self.collection: Optional[Collection] = None
+        self.client = _get_client(db_path)
+        self.embedding_function = get_embedding_function()
+        self.collection: Collection = self.client.get_or_create_collection(name=self.collection_name)
+        self.flat_index: Optional[FlatIndex] = None
+        self.metadata_frame: Optional[pd.DataFrame] = None
         
     def create_or_get_collection(self) -> Collection:
         """Get or create the collection."""
@@ -30,10 +501,12 @@ class RestaurantVectorStore:
         return self.collection
     
     def delete_collection(self) -> None:
-        """Delete the collection."""
+        """Delete the collection and replace it with an empty one."""
         try:
             self.client.delete_collection(name=self.collection_name)
-            self.collection = None
+            self.create_or_get_collection()
+            self.flat_index = None
+            self.metadata_frame = None
         except Exception as e:
             print(f"Error deleting collection: {e}")
     
@@ -42,7 +515,8 @@ class RestaurantVectorStore:
         df_restaurants: pd.DataFrame, 
         df_dishes: pd.DataFrame,
         top_n_dishes: int = 10,
-        force_reindex: bool = False
+        force_reindex: bool = False,
+        batch_size: int = UPSERT_BATCH_SIZE
     ) -> None:
         """
         Index all restaurants into the vector store.
@@ -52,24 +526,22 @@ class RestaurantVectorStore:
             df_dishes: DataFrame with dish data
             top_n_dishes: Number of top dishes to include per restaurant
             force_reindex: If True, delete and recreate the collection
+            batch_size: Maximum number of documents per upsert call
         """
         if force_reindex:
             self.delete_collection()
         
-        if self.collection is None:
-            self.create_or_get_collection()
-        
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for idx, row in df_restaurants.iterrows():
-            documents.append(make_restaurant_doc_with_dishes(row, df_dishes, top_n_dishes))
-            metadatas.append(make_metadata(row))
-            ids.append(f"rest_{row['id']}")
+        # Plain dicts per row are much cheaper than the Series built by iterrows
+        rows = df_restaurants.to_dict('records')
+        dish_highlights = build_dish_highlights(df_dishes, top_n_dishes)
+        documents = [make_restaurant_doc_with_dishes(row, dish_highlights) for row in rows]
+        metadatas = build_metadata_list(df_restaurants)
+        ids = [f"rest_{i}" for i in df_restaurants['id'].tolist()]
         
         # Use upsert to add or update documents
-        self.collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+        upsert_in_batches(self.collection, self.embedding_function, documents, metadatas, ids, batch_size)
+        self.flat_index = None  # Rebuilt from the collection on next search
+        self.metadata_frame = None
         print(f"Indexed {len(documents)} restaurants")
     
     def search(
@@ -91,38 +563,30 @@ class RestaurantVectorStore:
         Returns:
             Dictionary with search results
         """
-        if self.collection is None:
-            self.create_or_get_collection()
-        
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            where=where,
-            where_document=where_document
-        )
-        
-        return results
+        return search_store(self, query, n_results=n_results, where=where, where_document=where_document)
     
-    def get_by_id(self, restaurant_id: int) -> Optional[Dict[str, Any]]:
+    def get_by_id(
+        self,
+        restaurant_id: int,
+        include: Tuple[str, ...] = ('documents', 'metadatas')
+    ) -> Optional[Dict[str, Any]]:
         """
         Get a specific restaurant by ID.
         
         Args:
             restaurant_id: Restaurant ID
+            include: Fields to fetch; ones left out are None in the result
             
         Returns:
             Dictionary with restaurant data or None if not found
         """
-        if self.collection is None:
-            self.create_or_get_collection()
-        
         try:
-            result = self.collection.get(ids=[f"rest_{restaurant_id}"])
+            result = self.collection.get(ids=[f"rest_{restaurant_id}"], include=list(include))
             if result['ids']:
                 return {
                     'id': result['ids'][0],
-                    'document': result['documents'][0],
-                    'metadata': result['metadatas'][0]
+                    'document': result['documents'][0] if 'documents' in include else None,
+                    'metadata': result['metadatas'][0] if 'metadatas' in include else None
                 }
         except Exception as e:
             print(f"Error getting restaurant {restaurant_id}: {e}")
@@ -131,8 +595,6 @@ class RestaurantVectorStore:
     
     def count(self) -> int:
         """Get the number of documents in the collection."""
-        if self.collection is None:
-            self.create_or_get_collection()
         return self.collection.count()
 
 
@@ -149,8 +611,11 @@ class DishVectorStore:
         """
         self.db_path = db_path
         self.collection_name = collection_name
-        self.client = chromadb.PersistentClient(path=db_path)
-        self.collection: Optional[Collection] = None
+        self.client = _get_client(db_path)
+        self.embedding_function = get_embedding_function()
+        self.collection: Collection = self.client.get_or_create_collection(name=self.collection_name)
+        self.flat_index: Optional[FlatIndex] = None
+        self.metadata_frame: Optional[pd.DataFrame] = None
         
     def create_or_get_collection(self) -> Collection:
         """Get or create the collection."""
@@ -158,10 +623,12 @@ class DishVectorStore:
         return self.collection
     
     def delete_collection(self) -> None:
-        """Delete the collection."""
+        """Delete the collection and replace it with an empty one."""
         try:
             self.client.delete_collection(name=self.collection_name)
-            self.collection = None
+            self.create_or_get_collection()
+            self.flat_index = None
+            self.metadata_frame = None
         except Exception as e:
             print(f"Error deleting collection: {e}")
     
@@ -169,7 +636,8 @@ class DishVectorStore:
         self, 
         df_dishes: pd.DataFrame,
         df_restaurants: pd.DataFrame,
-        force_reindex: bool = False
+        force_reindex: bool = False,
+        batch_size: int = UPSERT_BATCH_SIZE
     ) -> None:
         """
         Index all dishes into the vector store.
@@ -178,24 +646,25 @@ class DishVectorStore:
             df_dishes: DataFrame with dish data
             df_restaurants: DataFrame with restaurant data for enrichment
             force_reindex: If True, delete and recreate the collection
+            batch_size: Maximum number of documents per upsert call
         """
         if force_reindex:
             self.delete_collection()
         
-        if self.collection is None:
-            self.create_or_get_collection()
-        
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for idx, row in df_dishes.iterrows():
-            documents.append(make_dish_doc(row))
-            metadatas.append(make_dish_metadata(row, df_restaurants))
-            ids.append(f"dish_{row['restaurant_id']}_{row['dish_id']}")
+        # Plain dicts per row are much cheaper than the Series built by iterrows
+        rows = df_dishes.to_dict('records')
+        documents = [make_dish_doc(row) for row in rows]
+        rest_lookup = build_restaurant_lookup(df_restaurants)
+        metadatas = [make_dish_metadata(row, rest_lookup) for row in rows]
+        ids = [
+            f"dish_{restaurant_id}_{dish_id}"
+            for restaurant_id, dish_id in zip(df_dishes['restaurant_id'].tolist(), df_dishes['dish_id'].tolist())
+        ]
         
         # Use upsert to add or update documents
-        self.collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+        upsert_in_batches(self.collection, self.embedding_function, documents, metadatas, ids, batch_size)
+        self.flat_index = None  # Rebuilt from the collection on next search
+        self.metadata_frame = None
         print(f"Indexed {len(documents)} dishes")
     
     def search(
@@ -203,7 +672,8 @@ class DishVectorStore:
         query: str, 
         n_results: int = 5,
         where: Optional[Dict[str, Any]] = None,
-        where_document: Optional[Dict[str, Any]] = None
+        where_document: Optional[Dict[str, Any]] = None,
+        ids: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """
         Search for dishes matching the query.
@@ -213,33 +683,31 @@ class DishVectorStore:
             n_results: Number of results to return
             where: Filter on metadata
             where_document: Filter on document content
+            ids: Only search these dish IDs
             
         Returns:
             Dictionary with search results
         """
-        if self.collection is None:
-            self.create_or_get_collection()
-        
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            where=where,
-            where_document=where_document
-        )
-        
-        return results
+        return search_store(self, query, n_results=n_results, where=where, where_document=where_document, ids=ids)
     
     def count(self) -> int:
         """Get the number of documents in the collection."""
-        if self.collection is None:
-            self.create_or_get_collection()
         return self.collection.count()
 
 
 class RestaurantSearch:
     """High-level interface for restaurant search."""
     
-    _instance = None  # Singleton instance for agent tools
+    # Metadata keys filtered by equality, in the order of the search arguments
+    _FILTER_KEYS = (
+        "price_level", "zone", "has_vegetarian", "has_vegan", "has_gluten_free",
+        "has_takeaway", "has_bar", "has_menu", "allow_reservations",
+        "latitude", "longitude", "opening_time", "closing_time",
+    )
+    _DISH_FILTER_KEYS = (
+        "zone", "price_level", "has_vegetarian", "has_vegan", "has_gluten_free",
+        "has_halal", "has_lactose_free", "category",
+    )
     
     def __init__(self, db_path: str = "chromadb", auto_load: bool = False):
         """
@@ -249,13 +717,17 @@ class RestaurantSearch:
             db_path: Path to ChromaDB storage
             auto_load: If True, automatically load and index data
         """
+        self.db_path = db_path
         self.vector_store = RestaurantVectorStore(db_path=db_path)
         self.dish_vector_store = DishVectorStore(db_path=db_path)
         self.df_restaurants: Optional[pd.DataFrame] = None
         self.df_dishes: Optional[pd.DataFrame] = None
-        
-        # Set as singleton instance for agent tools
-        RestaurantSearch._instance = self
+        self._dish_ids_by_restaurant: Optional[Dict[str, List[str]]] = None
+        self._name_to_id: Optional[Dict[str, int]] = None
+        self._zones: Tuple[str, ...] = ()
+        self._price_levels: Tuple[str, ...] = ()
+        # Bounds concurrent async searches so bursts queue instead of contending for the DB
+        self._search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
         
         if auto_load:
             self.load_and_index()
@@ -274,46 +746,86 @@ class RestaurantSearch:
             force_reindex: If True, delete and recreate the index
             top_n_dishes: Number of top dishes to include per restaurant
         """
+        sheet_id = sheet_id or SHEET_ID
+        version = get_sheet_version(sheet_id)
+        
         # Check if data already indexed (skip if not force_reindex)
-        if not force_reindex:
-            # Initialize collections to check counts
-            restaurant_collection = self.vector_store.create_or_get_collection()
-            dish_collection = self.dish_vector_store.create_or_get_collection()
-            
-            restaurant_count = restaurant_collection.count()
-            dish_count = dish_collection.count()
-            
-            if restaurant_count > 0 and dish_count > 0:
-                print(f"Data already indexed: {restaurant_count} restaurants, {dish_count} dishes")
-                print("Skipping indexing. Use force_reindex=True to re-index.")
-                return
+        marker_path = Path(self.db_path) / INDEX_MARKER
+        if force_reindex:
+            marker_path.unlink(missing_ok=True)
+        else:
+            marker = self._read_index_marker(marker_path)
+            if marker is None or marker.get("schema_version") != INDEX_SCHEMA_VERSION:
+                # Built before the marker or by an older schema, so stored metadata may lack
+                # fields that filters rely on (e.g. opening_minutes)
+                if self.vector_store.count() > 0 or self.dish_vector_store.count() > 0:
+                    print("Index was built with an older schema, re-indexing...")
+                    force_reindex = True
+                    marker_path.unlink(missing_ok=True)
+            elif marker["restaurants"] > 0 and marker["dishes"] > 0:
+                # Re-index from scratch if the sheet changed since the last run
+                if version is None or marker.get("sheet_etag") in (None, version):
+                    print(f"Data already indexed: {marker['restaurants']} restaurants, {marker['dishes']} dishes")
+                    print("Skipping indexing. Use force_reindex=True to re-index.")
+                    return
+                print("Sheet changed since last indexing, re-indexing...")
+                force_reindex = True
+                marker_path.unlink(missing_ok=True)
         
         print("Loading restaurant data...")
-        if sheet_id:
-            self.df_restaurants, self.df_dishes = load_restaurant_data(sheet_id)
-        else:
-            self.df_restaurants, self.df_dishes = load_restaurant_data()
+        self.df_restaurants, self.df_dishes = load_restaurant_data(sheet_id, version=version)
         
         print(f"Loaded {len(self.df_restaurants)} restaurants and {len(self.df_dishes)} dishes")
         
-        print("Indexing restaurants...")
-        self.vector_store.index_restaurants(
-            self.df_restaurants, 
-            self.df_dishes,
-            top_n_dishes=top_n_dishes,
-            force_reindex=force_reindex
-        )
-        print("Indexing complete!")
-        
-        # Index dishes separately
-        if len(self.df_dishes) > 0:
-            print("Indexing dishes...")
-            self.dish_vector_store.index_dishes(
-                self.df_dishes,
+        # The collections are independent, so one can write while the other embeds
+        print("Indexing restaurants and dishes...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            restaurants_done = executor.submit(
+                self.vector_store.index_restaurants,
                 self.df_restaurants,
+                self.df_dishes,
+                top_n_dishes=top_n_dishes,
                 force_reindex=force_reindex
             )
-            print("Dish indexing complete!")
+            dishes_done = None
+            if len(self.df_dishes) > 0:
+                dishes_done = executor.submit(
+                    self.dish_vector_store.index_dishes,
+                    self.df_dishes,
+                    self.df_restaurants,
+                    force_reindex=force_reindex
+                )
+            restaurants_done.result()
+            if dishes_done is not None:
+                dishes_done.result()
+        
+        self._write_index_marker(marker_path, {
+            "restaurants": self.vector_store.count(),
+            "dishes": self.dish_vector_store.count(),
+            "sheet_etag": version,
+            "schema_version": INDEX_SCHEMA_VERSION,
+        })
+        self._dish_ids_by_restaurant = None
+        self._name_to_id = self._build_name_to_id(
+            zip(self.df_restaurants['name'].tolist(), self.df_restaurants['id'].tolist())
+        )
+        self._zones = tuple(sorted(self.df_restaurants['zone'].dropna().unique().tolist()))
+        self._price_levels = tuple(sorted(self.df_restaurants['price_level'].dropna().unique().tolist()))
+        print("Indexing complete!")
+    
+    def _read_index_marker(self, marker_path: Path) -> Optional[Dict[str, Any]]:
+        """Read the counts, sheet version and schema version saved by the last full index, if any."""
+        try:
+            return json.loads(marker_path.read_text())
+        except (OSError, ValueError):
+            return None
+    
+    def _write_index_marker(self, marker_path: Path, marker: Dict[str, Any]) -> None:
+        """Save counts and versions so later starts can skip the DB check."""
+        try:
+            marker_path.write_text(json.dumps(marker))
+        except OSError as e:
+            print(f"Error writing index marker: {e}")
     
     def search(
         self,
@@ -332,7 +844,8 @@ class RestaurantSearch:
         longitude: Optional[float] = None,
         opening_time: Optional[str] = None,
         closing_time: Optional[str] = None,
-    ) -> List[Dict[str, Any]]:
+        open_at_minutes: Optional[int] = None,
+    ) -> List[SearchHit]:
         """
         Search for restaurants with optional filters.
         
@@ -352,96 +865,100 @@ class RestaurantSearch:
             longitude: Filter by longitude coordinate
             opening_time: Filter by opening time (e.g., "10:00")
             closing_time: Filter by closing time (e.g., "22:00")
+            open_at_minutes: Filter for restaurants open at this time (minutes since midnight)
             
         Returns:
-            List of restaurant results with metadata
-        """
-        # Build where clause from filters
-        where = {}
-        if price_level:
-            where["price_level"] = price_level
-        if zone:
-            where["zone"] = zone
-        if has_vegetarian is not None:
-            where["has_vegetarian"] = has_vegetarian
-        if has_vegan is not None:
-            where["has_vegan"] = has_vegan
-        if has_gluten_free is not None:
-            where["has_gluten_free"] = has_gluten_free
-        if has_takeaway is not None:
-            where["has_takeaway"] = has_takeaway
-        if has_bar is not None:
-            where["has_bar"] = has_bar
-        if has_menu is not None:
-            where["has_menu"] = has_menu
-        if allow_reservations is not None:
-            where["allow_reservations"] = allow_reservations
-        if latitude is not None:
-            where["latitude"] = latitude
-        if longitude is not None:
-            where["longitude"] = longitude
-        if opening_time is not None:
-            where["opening_time"] = opening_time
-        if closing_time is not None:
-            where["closing_time"] = closing_time
+            List of SearchHit results with metadata
+        """
+        # Build where clause from filters, skipping unset ones
+        values = (
+            price_level, zone, has_vegetarian, has_vegan, has_gluten_free,
+            has_takeaway, has_bar, has_menu, allow_reservations,
+            latitude, longitude, opening_time, closing_time,
+        )
+        where = {key: value for key, value in zip(self._FILTER_KEYS, values) if value not in (None, "")}
+        
+        if open_at_minutes is not None:
+            where["opening_minutes"] = {"$lte": open_at_minutes}
+            where["closing_minutes"] = {"$gte": open_at_minutes}
         
         # Perform search
         results = self.vector_store.search(
             query=query,
             n_results=n_results,
-            where=where if where else None
+            where=combine_where(where)
         )
         
-        # Format results
-        formatted_results = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                formatted_results.append({
-                    'id': results['ids'][0][i],
-                    'document': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                })
+        return to_search_hits(results)
+    
+    async def asearch(self, query: str, **filters: Any) -> List[SearchHit]:
+        """
+        Search for restaurants without blocking the event loop.
         
-        return formatted_results
+        Args:
+            query: Search query text
+            **filters: Any other argument accepted by search
+            
+        Returns:
+            List of SearchHit results with metadata
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_pool, functools.partial(self.search, query, **filters)
+        )
     
-    def get_restaurant(self, restaurant_id: int) -> Optional[Dict[str, Any]]:
+    def get_restaurant(
+        self,
+        restaurant_id: int,
+        include: Tuple[str, ...] = ('documents', 'metadatas')
+    ) -> Optional[Dict[str, Any]]:
         """
         Get a specific restaurant by ID.
         
         Args:
             restaurant_id: Restaurant ID
+            include: Fields to fetch ("documents", "metadatas")
             
         Returns:
             Restaurant data or None if not found
         """
-        return self.vector_store.get_by_id(restaurant_id)
+        return self.vector_store.get_by_id(restaurant_id, include=include)
     
-    def get_restaurant_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+    def get_restaurant_by_name(
+        self,
+        name: str,
+        include: Tuple[str, ...] = ('documents', 'metadatas')
+    ) -> Optional[Dict[str, Any]]:
         """
         Get a specific restaurant by name.
         
         Args:
             name: Restaurant name
+            include: Fields to fetch ("documents", "metadatas")
             
         Returns:
             Restaurant data or None if not found
         """
-        if self.vector_store.collection is None:
-            self.vector_store.create_or_get_collection()
-        
-        try:
-            result = self.vector_store.collection.get(where={"name": name})
-            if result['ids']:
-                return {
-                    'id': result['ids'][0],
-                    'document': result['documents'][0],
-                    'metadata': result['metadatas'][0]
-                }
-        except Exception as e:
-            print(f"Error getting restaurant {name}: {e}")
+        if self._name_to_id is None:
+            # Data was indexed by an earlier run, so build the map from stored metadata
+            data = self.vector_store.collection.get(include=['metadatas'])
+            self._name_to_id = self._build_name_to_id(
+                (metadata.get('name'), metadata.get('restaurant_id')) for metadata in data['metadatas']
+            )
         
-        return None
+        restaurant_id = self._name_to_id.get(str(name).strip().casefold())
+        if restaurant_id is None:
+            return None
+        return self.vector_store.get_by_id(restaurant_id, include=include)
+    
+    @staticmethod
+    def _build_name_to_id(pairs) -> Dict[str, int]:
+        """Map case-folded restaurant names to IDs, keeping the first of any duplicates."""
+        name_to_id = {}
+        for name, restaurant_id in pairs:
+            if isinstance(name, str) and restaurant_id is not None:
+                name_to_id.setdefault(name.strip().casefold(), int(restaurant_id))
+        return name_to_id
     
     def count(self) -> int:
         """Get the number of indexed restaurants."""
@@ -460,7 +977,7 @@ class RestaurantSearch:
         has_halal: Optional[bool] = None,
         has_lactose_free: Optional[bool] = None,
         category: Optional[str] = None,
-    ) -> List[Dict[str, Any]]:
+    ) -> List[SearchHit]:
         """
         Search for dishes with optional filters.
         
@@ -478,62 +995,65 @@ class RestaurantSearch:
             category: Filter by dish category
             
         Returns:
-            List of dish results with metadata including restaurant info
+            List of SearchHit results with metadata including restaurant info
         """
-        # Build where clause from filters
-        where = {}
+        # Restrict to the restaurant's dishes up front instead of filtering on its name
+        ids = None
         if restaurant_name:
-            where["restaurant_name"] = restaurant_name
-        if zone:
-            where["zone"] = zone
-        if price_level:
-            where["price_level"] = price_level
-        if has_vegetarian is not None:
-            where["has_vegetarian"] = has_vegetarian
-        if has_vegan is not None:
-            where["has_vegan"] = has_vegan
-        if has_gluten_free is not None:
-            where["has_gluten_free"] = has_gluten_free
-        if has_halal is not None:
-            where["has_halal"] = has_halal
-        if has_lactose_free is not None:
-            where["has_lactose_free"] = has_lactose_free
-        if category:
-            where["category"] = category
+            ids = self._dish_ids_for_restaurant(restaurant_name)
+            if not ids:
+                return []
+        
+        # Build where clause from filters, skipping unset ones
+        values = (
+            zone, price_level, has_vegetarian, has_vegan, has_gluten_free,
+            has_halal, has_lactose_free, category,
+        )
+        where = {key: value for key, value in zip(self._DISH_FILTER_KEYS, values) if value not in (None, "")}
         
         # Perform search
         results = self.dish_vector_store.search(
             query=query,
             n_results=n_results,
-            where=where if where else None
+            where=combine_where(where),
+            ids=ids
         )
         
-        # Format results
-        formatted_results = []
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                formatted_results.append({
-                    'id': results['ids'][0][i],
-                    'document': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'distance': results['distances'][0][i] if 'distances' in results else None
-                })
+        return to_search_hits(results)
+    
+    async def asearch_dishes(self, query: str, **filters: Any) -> List[SearchHit]:
+        """
+        Search for dishes without blocking the event loop.
         
-        return formatted_results
+        Args:
+            query: Search query text for dish names/descriptions
+            **filters: Any other argument accepted by search_dishes
+            
+        Returns:
+            List of SearchHit results with metadata including restaurant info
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_pool, functools.partial(self.search_dishes, query, **filters)
+        )
+    
+    def _dish_ids_for_restaurant(self, restaurant_name: str) -> List[str]:
+        """Get the IDs of a restaurant's dishes, indexing them by name on first use."""
+        if self._dish_ids_by_restaurant is None:
+            data = self.dish_vector_store.collection.get(include=['metadatas'])
+            self._dish_ids_by_restaurant = {}
+            for dish_id, metadata in zip(data['ids'], data['metadatas']):
+                self._dish_ids_by_restaurant.setdefault(metadata.get('restaurant_name'), []).append(dish_id)
+        return self._dish_ids_by_restaurant.get(restaurant_name, [])
     
     def count_dishes(self) -> int:
         """Get the number of indexed dishes."""
         return self.dish_vector_store.count()
     
     def get_available_zones(self) -> List[str]:
-        """Get list of available zones."""
-        if self.df_restaurants is None:
-            return []
-        zones = self.df_restaurants['zone'].dropna().unique().tolist()
-        return sorted(zones)
+        """Get list of available zones (computed when data is loaded)."""
+        return list(self._zones)
     
     def get_available_price_levels(self) -> List[str]:
-        """Get list of available price levels."""
-        if self.df_restaurants is None:
-            return []
-        return sorted(self.df_restaurants['price_level'].dropna().unique().tolist())
+        """Get list of available price levels (computed when data is loaded)."""
+        return list(self._price_levels)
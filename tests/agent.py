@@ -20,6 +20,7 @@ def test_agent_initialization():
     assert agent.chat is not None
     assert agent.search is not None
     assert len(agent.history) > 0  # Should have welcome message
+    assert agent.visible == agent.history[:1]  # Welcome message is shown
 
 
 @pytest.mark.skipif(not os.getenv("ANTHROPIC_API_KEY"), reason="API key not available")
@@ -29,3 +30,5 @@ def test_agent_chat():
     response = agent("Hola")
     assert response is not None
     assert len(agent.history) > 1  # Welcome + user message + response
+    assert agent.visible[1] == {'role': 'user', 'content': 'Hola'}
+    assert agent.visible[-1] is agent.history[-1]  # Final reply is shown
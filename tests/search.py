@@ -1,5 +1,16 @@
-from search.data_loader import load_restaurant_data, make_restaurant_doc_with_dishes, make_metadata, load_all_sheets, make_dish_doc, make_dish_metadata
-from search import RestaurantVectorStore, DishVectorStore
+import asyncio
+import hashlib
+import json
+
+import chromadb
+import numpy as np
+import pandas as pd
+import pytest
+
+from search.data_loader import load_restaurant_data, build_dish_highlights, make_restaurant_doc_with_dishes, make_metadata, load_all_sheets, make_dish_doc, build_restaurant_lookup, make_dish_metadata, parse_minutes
+from search import RestaurantVectorStore, DishVectorStore, RestaurantSearch
+from search import search as search_module
+from search.search import FlatIndex, INDEX_MARKER, INDEX_SCHEMA_VERSION, combine_where, where_mask
 
 
 def test_load_all_sheets():
@@ -27,8 +38,8 @@ def test_document_builder_functions():
         # Test with first restaurant
         row = df_restaurants.iloc[0]
         
-        # Test document builder (may need empty df if no dishes match)
-        doc = make_restaurant_doc_with_dishes(row, df_dishes)
+        # Test document builder (restaurant may have no matching dishes)
+        doc = make_restaurant_doc_with_dishes(row, build_dish_highlights(df_dishes))
         assert isinstance(doc, str)
         assert len(doc) > 20
         assert row['name'] in doc
@@ -76,8 +87,255 @@ def test_dish_vector_store_indexing():
     assert len(doc) > 10
     
     # Test dish metadata builder
-    metadata = make_dish_metadata(row, df_restaurants)
+    metadata = make_dish_metadata(row, build_restaurant_lookup(df_restaurants))
     assert isinstance(metadata, dict)
     assert 'dish_id' in metadata
     assert 'restaurant_id' in metadata
     assert 'restaurant_name' in metadata
+
+
+def test_parse_minutes():
+    """Test HH:MM parsing into minutes since midnight."""
+    assert parse_minutes("00:00") == 0
+    assert parse_minutes("09:30") == 570
+    assert parse_minutes("9:30") == 570
+    assert parse_minutes(" 21:00 ") == 1260
+    
+    assert parse_minutes("24:00") == 1440
+    
+    for invalid in ("late", "25:99", "99:00", "12:60", "24:30", "-1:00"):
+        with pytest.raises(ValueError):
+            parse_minutes(invalid)
+
+
+def _flat_index():
+    """Build a small FlatIndex with hand-picked unit vectors."""
+    ids = ["a", "b", "c", "d"]
+    metadatas = [
+        {"zone": "north", "price_level": "low", "has_vegan": True},
+        {"zone": "north", "price_level": "high", "has_vegan": False},
+        {"zone": "south", "price_level": "low", "has_vegan": True},
+        {"zone": "south", "price_level": "medium", "has_vegan": False},
+    ]
+    embeddings = [[1.0, 0.0, 0.0], [0.8, 0.6, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+    return FlatIndex(ids, [f"doc {i}" for i in ids], metadatas, embeddings)
+
+
+def test_combine_where():
+    """Test that multiple conditions are wrapped in $and."""
+    assert combine_where({}) is None
+    assert combine_where({"zone": "north"}) == {"zone": "north"}
+    assert combine_where({"zone": "north", "opening_minutes": {"$lte": 600}}) == {
+        "$and": [{"zone": "north"}, {"opening_minutes": {"$lte": 600}}]
+    }
+
+
+def test_flat_index_search():
+    """Test FlatIndex ranking, filtering, ID scoping and empty results."""
+    index = _flat_index()
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    
+    # Unfiltered: ranked by similarity, limited to n_results
+    results = index.search(query, n_results=3)
+    assert results['ids'] == [["a", "b", "c"]]
+    assert results['documents'] == [["doc a", "doc b", "doc c"]]
+    assert results['metadatas'][0][0]['zone'] == "north"
+    
+    # Filtered
+    results = index.search(query, n_results=5, where=combine_where({"zone": "south", "has_vegan": True}))
+    assert results['ids'] == [["c"]]
+    
+    # Scoped to IDs (unknown IDs are ignored), with and without a filter
+    assert index.search(query, n_results=5, ids=["d", "b", "x"])['ids'] == [["b", "d"]]
+    assert index.search(query, n_results=5, where={"price_level": "high"}, ids=["c", "d"])['ids'] == [[]]
+    
+    # No matches
+    assert index.search(query, where={"zone": "east"}) == {
+        'ids': [[]], 'documents': [[]], 'metadatas': [[]], 'distances': [[]]
+    }
+
+
+def test_flat_index_distances_match_chroma():
+    """Test that FlatIndex distances equal ChromaDB's default squared L2."""
+    index = _flat_index()
+    query = [0.6, 0.8, 0.0]
+    
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name="flat_parity")
+    collection.upsert(ids=index.ids, documents=index.documents, metadatas=index.metadatas, embeddings=index.vectors.tolist())
+    expected = collection.query(query_embeddings=[query], n_results=4)
+    
+    results = index.search(np.array(query, dtype=np.float32), n_results=4)
+    assert results['ids'] == expected['ids']
+    assert results['distances'][0] == pytest.approx(expected['distances'][0], abs=1e-5)
+
+
+def _where_ids(frame, where):
+    """IDs of the frame rows matched by a where filter."""
+    return frame.index[where_mask(frame, where)].tolist()
+
+
+def test_where_mask():
+    """Test where filter operators, combinators, missing keys and type mismatches."""
+    frame = pd.DataFrame([
+        {"zone": "north", "opening_minutes": 540, "has_bar": True},
+        {"zone": "south", "opening_minutes": 720, "has_bar": False},
+        {"zone": "north", "opening_minutes": -1},
+        {"opening_minutes": 600, "has_bar": True},
+    ], index=["a", "b", "c", "d"])
+    
+    # Each operator; rows without the key only match negated operators
+    assert _where_ids(frame, {"zone": "north"}) == ["a", "c"]
+    assert _where_ids(frame, {"zone": {"$eq": "south"}}) == ["b"]
+    assert _where_ids(frame, {"zone": {"$ne": "north"}}) == ["b", "d"]
+    assert _where_ids(frame, {"opening_minutes": {"$gt": 540}}) == ["b", "d"]
+    assert _where_ids(frame, {"opening_minutes": {"$gte": 540}}) == ["a", "b", "d"]
+    assert _where_ids(frame, {"opening_minutes": {"$lt": 600}}) == ["a", "c"]
+    assert _where_ids(frame, {"opening_minutes": {"$lte": 600}}) == ["a", "c", "d"]
+    assert _where_ids(frame, {"zone": {"$in": ["south", "east"]}}) == ["b"]
+    assert _where_ids(frame, {"zone": {"$nin": ["north"]}}) == ["b", "d"]
+    assert _where_ids(frame, {"opening_minutes": {"$gte": 540, "$lte": 600}}) == ["a", "d"]
+    
+    # Combinators
+    assert _where_ids(frame, {"$and": [{"zone": "north"}, {"opening_minutes": {"$gte": 0}}]}) == ["a"]
+    assert _where_ids(frame, {"$or": [{"zone": "south"}, {"has_bar": True}]}) == ["a", "b", "d"]
+    assert _where_ids(frame, {"$and": [{"$or": [{"zone": "north"}, {"zone": "south"}]}, {"has_bar": False}]}) == ["b"]
+    
+    # NaN values (key missing from some documents) and keys missing from every document
+    assert _where_ids(frame, {"has_bar": False}) == ["b"]
+    assert _where_ids(frame, {"has_bar": {"$ne": True}}) == ["b", "c"]
+    assert _where_ids(frame, {"category": "dessert"}) == []
+    assert _where_ids(frame, {"category": {"$ne": "dessert"}}) == ["a", "b", "c", "d"]
+    
+    # Incomparable types match nothing instead of raising
+    assert _where_ids(frame, {"zone": {"$gt": 5}}) == []
+    
+    # Booleans and numbers never compare equal, although True == 1 in Python
+    assert _where_ids(frame, {"has_bar": 1}) == []
+    assert _where_ids(frame, {"has_bar": {"$in": [1, 0]}}) == []
+    assert _where_ids(frame, {"has_bar": {"$ne": 1}}) == ["a", "b", "c", "d"]
+    assert _where_ids(frame, {"has_bar": {"$gt": 0}}) == []
+
+
+def test_where_mask_matches_chroma():
+    """Test that where_mask selects the same documents as ChromaDB's where filter."""
+    ids = ["b", "i", "s", "n"]
+    metadatas = [{"v": True, "k": 1}, {"v": 1, "k": 2}, {"v": "1", "k": 3}, {"k": 4}]
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name="where_parity")
+    collection.upsert(ids=ids, embeddings=[[1.0, 0.0]] * len(ids), metadatas=metadatas)
+    frame = pd.DataFrame(metadatas, index=ids)
+    
+    for where in [
+        {"v": True}, {"v": 1}, {"v": "1"}, {"v": {"$ne": True}}, {"v": {"$ne": 1}},
+        {"v": {"$in": [1]}}, {"v": {"$in": [True]}}, {"v": {"$in": ["1", "2"]}}, {"v": {"$nin": [1]}},
+        {"k": {"$gt": 1}}, {"$or": [{"v": True}, {"k": {"$gte": 3}}]},
+    ]:
+        assert sorted(_where_ids(frame, where)) == sorted(collection.get(where=where)['ids']), where
+
+
+def _fake_embed(texts):
+    """Deterministic unit vectors derived from each text's hash."""
+    vectors = np.array([np.frombuffer(hashlib.sha256(t.encode()).digest()[:8], dtype=np.uint8) for t in texts], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _sheet_frames():
+    """Small restaurant and dish frames shaped like load_restaurant_data output."""
+    df_restaurants = pd.DataFrame({
+        'id': [1, 2, 3],
+        'name': ['Andreu', 'Dino', 'Gasso'],
+        'description_short': ['Cafe', 'Ice cream', 'Bakery'],
+        'description_long': ['Coffee and pastries', 'Italian ice cream', 'Bread and cakes'],
+        'price_level': ['low', 'medium', 'low'],
+        'dietary_tags': ['vegetarian', 'vegan', None],
+        'services': ['takeaway', 'bar', None],
+        'opening_hours': ['09:00-22:00', '12:00-23:30', None],
+        'zone': ['north', 'north', 'south'],
+        'lat': [41.61, 41.62, 41.60],
+        'lng': [2.34, 2.35, 2.33],
+    })
+    df_dishes = pd.DataFrame({
+        'restaurant_id': [1, 1, 2],
+        'dish_id': [10, 11, 12],
+        'weight': [5.0, 3.0, 4.0],
+        'text': ['Croissant', 'Espresso', 'Pistachio gelato'],
+        'category': ['bakery', 'drinks', 'dessert'],
+        'dietary_tags': ['vegetarian', 'vegan', 'vegetarian'],
+        'name': ['Andreu', 'Andreu', 'Dino'],
+    })
+    return df_restaurants, df_dishes
+
+
+@pytest.fixture
+def offline_search(tmp_path, monkeypatch):
+    """RestaurantSearch factory on a temp DB with a stubbed sheet and fake embeddings."""
+    sheet = {'version': '"v1"', 'loads': 0}
+    
+    def load(sheet_id, version=None):
+        sheet['loads'] += 1
+        return _sheet_frames()
+    
+    monkeypatch.setattr(search_module, 'get_embedding_function', lambda: _fake_embed)
+    monkeypatch.setattr(search_module, 'EMBEDDING_CACHE_PATH', tmp_path / "embeddings")
+    monkeypatch.setattr(search_module, 'get_sheet_version', lambda sheet_id: sheet['version'])
+    monkeypatch.setattr(search_module, 'load_restaurant_data', load)
+    search_module._embed_normalized_query.cache_clear()
+    
+    db_path = str(tmp_path / "chromadb")
+    yield lambda: RestaurantSearch(db_path=db_path), sheet, tmp_path / "chromadb" / INDEX_MARKER
+    search_module._embed_normalized_query.cache_clear()
+
+
+def test_load_and_index_decisions(offline_search):
+    """Test when load_and_index re-indexes and when it skips."""
+    make_search, sheet, marker_path = offline_search
+    
+    # Cold start indexes everything and writes the marker
+    make_search().load_and_index()
+    assert sheet['loads'] == 1
+    marker = json.loads(marker_path.read_text())
+    assert marker == {"restaurants": 3, "dishes": 3, "sheet_etag": '"v1"', "schema_version": INDEX_SCHEMA_VERSION}
+    
+    # Same sheet version, or an unknown one: skip
+    make_search().load_and_index()
+    sheet['version'] = None
+    make_search().load_and_index()
+    assert sheet['loads'] == 1
+    
+    # Changed sheet version: re-index and record it
+    sheet['version'] = '"v2"'
+    make_search().load_and_index()
+    assert sheet['loads'] == 2
+    assert json.loads(marker_path.read_text())["sheet_etag"] == '"v2"'
+    
+    # force_reindex always re-indexes
+    make_search().load_and_index(force_reindex=True)
+    assert sheet['loads'] == 3
+    
+    # Marker from an older schema, or no marker at all: re-index
+    marker_path.write_text(json.dumps({**marker, "sheet_etag": '"v2"', "schema_version": INDEX_SCHEMA_VERSION - 1}))
+    make_search().load_and_index()
+    assert sheet['loads'] == 4
+    marker_path.unlink()
+    search = make_search()
+    search.load_and_index()
+    assert sheet['loads'] == 5
+    assert json.loads(marker_path.read_text())["schema_version"] == INDEX_SCHEMA_VERSION
+    assert search.count() == 3
+    assert search.count_dishes() == 3
+
+
+def test_async_search_matches_sync(offline_search):
+    """Test that asearch and asearch_dishes return the sync results and forward filters."""
+    make_search, _, _ = offline_search
+    search = make_search()
+    search.load_and_index()
+    
+    results = asyncio.run(search.asearch("coffee", n_results=3, price_level="low", zone="north"))
+    assert results == search.search("coffee", n_results=3, price_level="low", zone="north")
+    assert [hit.metadata['name'] for hit in results] == ["Andreu"]
+    
+    dishes = asyncio.run(search.asearch_dishes("dessert", n_results=5, restaurant_name="Andreu", has_vegan=True))
+    assert dishes == search.search_dishes("dessert", n_results=5, restaurant_name="Andreu", has_vegan=True)
+    assert [hit.metadata['dish_id'] for hit in dishes] == [11]